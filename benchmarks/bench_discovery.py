@@ -0,0 +1,132 @@
+# Copyright 2017 datawire. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Time service discovery over a generated monorepo: a number of
+services, each with nested source directories, ignore files at a few
+levels, and an ignored build directory per service. The previous
+approach of recompiling every accumulated ignore pattern for each
+directory is timed alongside for comparison, as is a second search
+that gets to use the discovery index left behind by the first.
+
+Given a latency, every directory listing is slowed down by that many
+milliseconds, as on a network file system, and a cold search with a
+single walker is compared with one using the default number.
+
+Usage: python benchmarks/bench_discovery.py [FILES [LATENCY_MS]]
+"""
+
+import eventlet, os, pathspec, shutil, subprocess, sys, tempfile, time
+from forge import service
+from forge.core import Forge
+from forge.service import Discovery, get_ignores
+
+SERVICES = 20
+DIRS_PER_LEVEL = 5
+FILES_PER_DIR = 10
+
+def mktree(files):
+    root = tempfile.mkdtemp()
+    subprocess.check_call(["git", "init", "-q", root])
+    with open(os.path.join(root, ".gitignore"), "w") as fd:
+        fd.write("*.pyc\n*.log\n.cache/\n")
+    per_service = files // SERVICES
+    for s in range(SERVICES):
+        svc = os.path.join(root, "services", "svc%02d" % s)
+        os.makedirs(os.path.join(svc, "build"))
+        with open(os.path.join(svc, "service.yaml"), "w") as fd:
+            fd.write("name: svc%02d\n" % s)
+        with open(os.path.join(svc, "Dockerfile"), "w") as fd:
+            fd.write("FROM scratch\n")
+        with open(os.path.join(svc, ".forgeignore"), "w") as fd:
+            fd.write("build/\n*.tmp\n")
+        for i in range(100):
+            open(os.path.join(svc, "build", "artifact%d" % i), "w").close()
+        count = 0
+        todo = [svc]
+        while count < per_service:
+            d = todo.pop(0)
+            for i in range(DIRS_PER_LEVEL):
+                sub = os.path.join(d, "pkg%d" % i)
+                os.mkdir(sub)
+                todo.append(sub)
+                for j in range(FILES_PER_DIR):
+                    ext = (".py", ".pyc", ".tmp", ".txt", ".py")[j % 5]
+                    open(os.path.join(sub, "mod%d%s" % (j, ext)), "w").close()
+                    count += 1
+    git = ["git", "-C", root, "-c", "user.name=bench", "-c", "user.email=bench@example.com"]
+    subprocess.check_call(git + ["add", "-A"])
+    subprocess.check_call(git + ["commit", "-q", "-m", "tree"])
+    return root
+
+def legacy_search(directory):
+    """
+    Discovery.search as it used to be, minus the service parsing.
+    """
+    services = []
+    def descend(path, ignores):
+        ignores = ignores + get_ignores(path)
+        spec = pathspec.PathSpec.from_lines('gitwildmatch', ignores)
+        names = [n for n in os.listdir(path)
+                 if not spec.match_file(os.path.relpath(os.path.join(path, n), directory))]
+        if "service.yaml" in names:
+            services.append(path)
+        for n in names:
+            child = os.path.join(path, n)
+            if os.path.isdir(child):
+                descend(child, ignores)
+    descend(directory, [".git", ".forge"] + get_ignores(directory))
+    return services
+
+def slow(latency):
+    sleep = eventlet.patcher.original('time').sleep
+    scandir = service._scandir
+    def slow_scandir(directory):
+        sleep(latency)
+        return scandir(directory)
+    service._scandir = slow_scandir
+
+def cold(root, walkers):
+    shutil.rmtree(os.path.join(root, ".forge"), True)
+    service.WALKERS = walkers
+    return Discovery(Forge()).search(root)
+
+def timed(fun, *args):
+    start = time.time()
+    result = fun(*args)
+    return time.time() - start, result
+
+if __name__ == "__main__":
+    files = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    latency = float(sys.argv[2])/1000 if len(sys.argv) > 2 else None
+    root = mktree(files)
+    try:
+        if latency is not None:
+            slow(latency)
+            print "cold discovery over %s generated files, %sms per listing" % (files, latency*1000)
+            for walkers in (1, service.WALKERS):
+                elapsed, found = timed(cold, root, walkers)
+                print "  %2d walkers %6.2fs  (%s services)" % (walkers, elapsed, len(found))
+            sys.exit(0)
+        print "discovery over %s generated files in %s services" % (files, SERVICES)
+        elapsed, found = timed(legacy_search, root)
+        print "  recompiled per directory %6.2fs  (%s services)" % (elapsed, len(found))
+        elapsed, found = timed(Discovery(Forge()).search, root)
+        print "  layered matcher          %6.2fs  (%s services, %s files)" % (
+            elapsed, len(found), sum(len(s.files) for s in found))
+        elapsed, found = timed(Discovery(Forge()).search, root)
+        print "  with the index           %6.2fs  (%s services, %s files)" % (
+            elapsed, len(found), sum(len(s.files) for s in found))
+    finally:
+        shutil.rmtree(root)
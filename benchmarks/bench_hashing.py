@@ -0,0 +1,77 @@
+# Copyright 2017 datawire. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Time hashing a service's files for its version: a lot of small source
+files and a few large assets, hashed sequentially in one go as it
+used to be, then with the hashing engine, first cold and then with
+its stat cache.
+
+Usage: python benchmarks/bench_hashing.py [FILES [MEGABYTES]]
+"""
+
+import hashlib, os, shutil, sys, tempfile, time
+from forge.hashing import shafiles
+from forge.tasks import executor
+
+def mktree(files, megabytes):
+    root = tempfile.mkdtemp()
+    names = []
+    for i in range(files):
+        name = "src/mod%05d.py" % i
+        path = os.path.join(root, name)
+        if not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, "w") as fd:
+            fd.write("# module %s\n" % i * 50)
+        names.append(name)
+    block = os.urandom(1024*1024)
+    for i in range(4):
+        name = "asset%d.bin" % i
+        with open(os.path.join(root, name), "w") as fd:
+            for _ in range(megabytes // 4):
+                fd.write(block)
+        names.append(name)
+    # old enough for the stat cache to trust
+    past = time.time() - 60
+    for name in names:
+        os.utime(os.path.join(root, name), (past, past))
+    return root, names
+
+def sequential(root, files):
+    result = hashlib.sha1()
+    result.update("files %s\0" % len(files))
+    for name in files:
+        result.update("file %s\0" % name)
+        with open(os.path.join(root, name)) as fd:
+            result.update(fd.read())
+    return result.hexdigest()
+
+def timed(fun, *args):
+    start = time.time()
+    fun(*args)
+    return time.time() - start
+
+if __name__ == "__main__":
+    files = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    megabytes = int(sys.argv[2]) if len(sys.argv) > 2 else 400
+    executor.setup()
+    root, names = mktree(files, megabytes)
+    try:
+        print "hashing %s files and %sMB of assets" % (files, megabytes)
+        print "  sequential   %6.2fs" % timed(sequential, root, names)
+        print "  cold         %6.2fs" % timed(shafiles, root, names)
+        print "  stat cache   %6.2fs" % timed(shafiles, root, names)
+    finally:
+        shutil.rmtree(root)
@@ -0,0 +1,88 @@
+# Copyright 2017 datawire. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Measure the latency of registry style HTTP checks against a local
+server while a large tree of files is hashed, with the hashing running
+on the hub and offloaded to the thread pool.
+
+Usage: python benchmarks/bench_offload.py [MEGABYTES]
+"""
+
+import eventlet, hashlib, os, shutil, sys, tempfile, time
+from eventlet import wsgi
+from forge.tasks import executor, get
+from forge.hashing import shafiles
+
+def app(env, start_response):
+    start_response("200 OK", [("Content-Type", "application/json")])
+    return ["{}"]
+
+def mktree(megabytes):
+    root = tempfile.mkdtemp()
+    files = []
+    block = os.urandom(1024*1024)
+    for i in range(megabytes):
+        name = "asset-%04d.bin" % i
+        with open(os.path.join(root, name), "w") as fd:
+            fd.write(block)
+        files.append(name)
+    return root, files
+
+def hash_on_hub(root, files):
+    result = hashlib.sha1()
+    for name in files:
+        with open(os.path.join(root, name), "rb") as fd:
+            result.update(fd.read())
+    return result.hexdigest()
+
+def checks(url, running):
+    latencies = []
+    while running():
+        start = time.time()
+        get(url, retries=0)
+        latencies.append(time.time() - start)
+        eventlet.sleep(0.005)
+    return latencies
+
+def measure(url, hasher):
+    start = time.time()
+    thread = eventlet.spawn(hasher)
+    # give the checker a head start so that it is mid request when
+    # the hashing kicks in
+    latencies = checks(url, lambda: not thread.dead or time.time() - start < 0.2)
+    thread.wait()
+    return time.time() - start, sorted(latencies)
+
+def percentile(values, p):
+    return values[min(len(values) - 1, int(len(values)*p))]
+
+if __name__ == "__main__":
+    megabytes = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    executor.setup()
+    sock = eventlet.listen(("127.0.0.1", 0))
+    eventlet.spawn(wsgi.server, sock, app, log=open(os.devnull, "w"))
+    url = "http://127.0.0.1:%s/v2/" % sock.getsockname()[1]
+    root, files = mktree(megabytes)
+    try:
+        print "registry checks while hashing %sMB" % megabytes
+        for name, hasher in (("idle", lambda: eventlet.sleep(1)),
+                             ("on hub", lambda: hash_on_hub(root, files)),
+                             ("offloaded", lambda: shafiles(root, files))):
+            elapsed, latencies = measure(url, hasher)
+            print "  %-10s %6.2fs  %4d checks  p50 %7.1fms  p99 %7.1fms  max %7.1fms" % (
+                name, elapsed, len(latencies), percentile(latencies, 0.5)*1000,
+                percentile(latencies, 0.99)*1000, latencies[-1]*1000)
+    finally:
+        shutil.rmtree(root)
@@ -0,0 +1,43 @@
+# Copyright 2017 datawire. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Measure the cost of streaming task output from several concurrent
+contexts through the executor's stdout multiplexer.
+
+Usage: python benchmarks/bench_output.py [LINES] > /dev/null
+"""
+
+import eventlet, sys, time
+from forge.executor import executor
+
+def chatter(n):
+    for i in xrange(n):
+        line = "Step %s/%s : RUN make -j8 all && some more output\n" % (i, n)
+        sys.stdout.write(line)
+        if i % 10 == 0:
+            eventlet.sleep()
+
+def builds(n):
+    for name in ("api", "web", "worker", "cron"):
+        executor(name, async=True).run(chatter, n)
+
+if __name__ == "__main__":
+    N = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    executor.setup()
+    start = time.time()
+    executor("root").run(builds, N).get()
+    sys.stdout.flush()
+    elapsed = time.time() - start
+    sys.stderr.write("%s lines in %.2fs\n" % (4*N, elapsed))
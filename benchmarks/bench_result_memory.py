@@ -0,0 +1,57 @@
+# Copyright 2017 datawire. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Measure the peak memory of a large result tree under each retention
+mode. Every task returns a chunk of output the way an sh invocation
+would. Each mode is measured in a fresh process.
+
+Usage: python benchmarks/bench_result_memory.py [N] [OUTPUT_BYTES]
+"""
+
+import resource, subprocess, sys
+from forge.executor import executor, RETAIN_ALL, RETAIN_ERRORS
+
+def command(i):
+    return "x"*SIZE
+
+def service(i):
+    exe = executor("command", async=True)
+    for j in xrange(10):
+        exe.run(command, j)
+
+def build():
+    exe = executor("service", async=True)
+    for i in xrange(N/10):
+        exe.run(service, i)
+
+def measure(mode):
+    executor.setup()
+    sys.stdout = sys.__stdout__
+    result = executor("root", retain=mode).run(build)
+    result.wait()
+    assert result.size == N + N/10 + 1
+    # ru_maxrss is in kilobytes on linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+if __name__ == "__main__":
+    N = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    SIZE = int(sys.argv[2]) if len(sys.argv) > 2 else 4096
+    if len(sys.argv) > 3:
+        print measure(sys.argv[3])
+    else:
+        print "%s tasks returning %s bytes each" % (N, SIZE)
+        for mode in (RETAIN_ALL, RETAIN_ERRORS):
+            rss = subprocess.check_output([sys.executable, __file__, str(N), str(SIZE), mode])
+            print "  %-6s peak rss %8.1f MB" % (mode, int(rss)/1024.0)
@@ -0,0 +1,57 @@
+# Copyright 2017 datawire. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Measure how long it takes to wait on and report a large result tree.
+
+Usage: python benchmarks/bench_result_tree.py [N]
+"""
+
+import sys, time
+from forge.executor import executor
+
+def leaf(i):
+    if i % 1000 == 0:
+        raise ValueError(i)
+
+def group(start, count):
+    exe = executor("leaf", async=True)
+    for i in xrange(start, start + count):
+        exe.run(leaf, i)
+
+def wide():
+    exe = executor("group", async=True)
+    for start in xrange(0, N, 100):
+        exe.run(group, start, 100)
+
+def chain(depth):
+    if depth:
+        executor("chain", async=True).run(chain, depth - 1)
+
+def bench(fun, *args):
+    start = time.time()
+    result = executor("root").run(fun, *args)
+    ran = time.time()
+    report = result.report(autocolor=False)
+    reported = time.time()
+    summary = [l for l in report.splitlines() if "tasks run" in l]
+    return ran - start, reported - ran, summary[0]
+
+if __name__ == "__main__":
+    N = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    executor.setup()
+    sys.stdout = sys.__stdout__
+    for label, fun, args in (("wide", wide, ()), ("deep", chain, (N/10,))):
+        ran, reported, summary = bench(fun, *args)
+        print "%-5s run %6.2fs  report %6.3fs  (%s)" % (label, ran, reported, summary.strip())
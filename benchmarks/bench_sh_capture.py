@@ -0,0 +1,48 @@
+# Copyright 2017 datawire. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Pipe a large amount of line oriented output through sh under each
+capture mode, reporting the time taken and the peak memory. Each
+mode is measured in a fresh process.
+
+Usage: python benchmarks/bench_sh_capture.py [MEGABYTES] [MODE]
+"""
+
+import resource, subprocess, sys, time
+from forge.tasks import sh, CAPTURE_FULL, CAPTURE_TAIL, CAPTURE_DISCARD, CAPTURE_SPILL
+
+LINE = "Step 12/40 : RUN apt-get install -y build-essential and friends"
+
+def measure(megabytes, mode):
+    cmd = "yes '%s' | head -c %d" % (LINE, megabytes*1024*1024)
+    start = time.time()
+    result = sh("sh", "-c", cmd, capture=mode)
+    elapsed = time.time() - start
+    # reading back spilled output would defeat the point of spilling
+    size = "-" if mode == CAPTURE_SPILL else len(result.output)
+    # ru_maxrss is in kilobytes on linux
+    return elapsed, size, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+if __name__ == "__main__":
+    megabytes = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    if len(sys.argv) > 2:
+        print "%s %s %s" % measure(megabytes, sys.argv[2])
+    else:
+        print "%sMB through sh" % megabytes
+        for mode in (CAPTURE_FULL, CAPTURE_SPILL, CAPTURE_TAIL, CAPTURE_DISCARD):
+            out = subprocess.check_output([sys.executable, __file__, str(megabytes), mode])
+            elapsed, size, rss = out.split()
+            print "  %-8s %7.2fs  peak rss %7.1f MB  (%s bytes kept)" % (mode, float(elapsed),
+                                                                          int(rss)/1024.0, size)
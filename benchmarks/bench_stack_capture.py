@@ -0,0 +1,49 @@
+# Copyright 2017 datawire. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Measure the per-task overhead of each executor stack capture mode.
+
+Usage: python benchmarks/bench_stack_capture.py [N]
+"""
+
+import sys, time
+from forge.executor import executor, STACK_FULL, STACK_LAZY, STACK_OFF
+
+def noop():
+    pass
+
+def nested(depth):
+    # give the stack some realistic depth
+    if depth:
+        return nested(depth - 1)
+    exe = executor("bench", async=True)
+    start = time.time()
+    for i in xrange(N):
+        exe.run(noop)
+    exe.wait()
+    return time.time() - start
+
+def bench(mode):
+    exe = executor("root", stack=mode)
+    return exe.run(nested, 20).get()
+
+if __name__ == "__main__":
+    N = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    executor.setup()
+    sys.stdout = sys.__stdout__
+    print "%s tasks" % N
+    for mode in (STACK_FULL, STACK_LAZY, STACK_OFF):
+        elapsed = bench(mode)
+        print "  %-5s %8.2f us/task" % (mode, elapsed/N*1e6)
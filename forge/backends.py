@@ -0,0 +1,90 @@
+# Copyright 2017 datawire. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Backends determine where the code for an executor invocation actually
+runs. The executor module is loaded with eventlet.import_patched, so
+these live in their own module in order to be importable by name from
+worker processes.
+"""
+
+import atexit, sys
+from eventlet import tpool
+
+class _GreenBackend(object):
+
+    """
+    Runs the function directly on the current greenthread.
+    """
+
+    def call(self, fun, args, kwargs):
+        return fun(*args, **kwargs)
+
+class _ThreadBackend(object):
+
+    """
+    Runs the function on a real OS thread from the eventlet thread
+    pool. This is useful for blocking or GIL releasing work such as
+    file I/O and hashing.
+    """
+
+    def call(self, fun, args, kwargs):
+        return tpool.execute(fun, *args, **kwargs)
+
+def _apply_by_name(module, name, args, kwargs):
+    __import__(module)
+    fun = getattr(sys.modules[module], name)
+    # unwrap task decorators so we don't try to run an executor in
+    # the worker process
+    task = getattr(fun, "task", None)
+    if task is not None:
+        fun = task.function
+    return fun(*args, **kwargs)
+
+class _ProcessBackend(object):
+
+    """
+    Runs the function in a worker process. The function is shipped to
+    the worker by name, so it must be a module level function, and its
+    arguments, result, and any exception it raises must be picklable.
+    """
+
+    def __init__(self, processes=None):
+        self.processes = processes
+        self.pool = None
+
+    def call(self, fun, args, kwargs):
+        if self.pool is None:
+            # this is imported lazily so that multiprocessing does not
+            # pick up green versions of the modules it depends on, and
+            # so that nothing is forked unless a task asks for it
+            import multiprocessing
+            self.pool = multiprocessing.Pool(self.processes)
+            atexit.register(self.close)
+        return tpool.execute(self.pool.apply, _apply_by_name, (fun.__module__, fun.__name__, args, kwargs))
+
+    def close(self):
+        """
+        Shut down the worker processes, if there are any.
+        """
+        pool, self.pool = self.pool, None
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+
+BACKENDS = {
+    "green": _GreenBackend(),
+    "thread": _ThreadBackend(),
+    "process": _ProcessBackend()
+}
@@ -0,0 +1,197 @@
+# Copyright 2017 datawire. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Detects code that holds on to the eventlet hub for too long. Nothing
+else gets to run while a greenthread is busy without yielding, e.g.
+in a non-green library call or CPU heavy work, so this is what
+destroys the concurrency of a build.
+
+A greenlet switch hook keeps track of which greenthread is running
+and since when, and a sampler on a real thread grabs the stack of
+any greenthread that has been running longer than the threshold.
+Once the greenthread finally yields, the stall is reported along with
+that stack and the executor context of the task it was running.
+"""
+
+import atexit, eventlet, greenlet, os, sys, traceback
+from collections import OrderedDict
+from .tasks import executor
+
+_thread = eventlet.patcher.original('thread')
+_time = eventlet.patcher.original('time')
+
+"""Report greenthreads that hold the hub for longer than this many seconds."""
+THRESHOLD = 0.1
+
+# frames from these files are glue rather than the code responsible
+# for a stall
+_GLUE = ("forge/executor.py", "forge/backends.py", "forge/blocking.py", "forge/tasks.py")
+_FORGE = os.path.dirname(os.path.abspath(__file__))
+
+class Offender(object):
+
+    def __init__(self, context, location, stack):
+        self.context = context
+        self.location = location
+        self.stack = stack
+        self.count = 0
+        self.total = 0.0
+        self.worst = 0.0
+
+class Detector(object):
+
+    def __init__(self, threshold=THRESHOLD, stream=None, verbose=True):
+        self.threshold = threshold
+        self.stream = stream or sys.stderr
+        self.verbose = verbose
+        self.hub = None
+        self.thread = _thread.get_ident()
+        self.previous = None
+        self.running = False
+        # the greenthread that is running, since when, and the stack
+        # and context the sampler caught it with, if it caught it at all
+        self.current = None
+        self.since = _time.time()
+        self.sample = None
+        self.offenders = OrderedDict()
+
+    def start(self):
+        self.hub = eventlet.hubs.get_hub().greenlet
+        self.previous = greenlet.settrace(self._trace)
+        self.running = True
+        # have the executor track which greenthread runs what
+        executor.TRACK = True
+        # held by the sampler for as long as it runs
+        self.sampling = _thread.allocate_lock()
+        self.sampling.acquire()
+        _thread.start_new_thread(self._sample_loop, ())
+
+    def stop(self):
+        if self.running:
+            self.running = False
+            executor.TRACK = False
+            greenlet.settrace(self.previous)
+            # don't leave the sampler running into interpreter shutdown
+            self.sampling.acquire()
+
+    def _trace(self, event, args):
+        if event in ("switch", "throw"):
+            origin, target = args
+            now = _time.time()
+            elapsed = now - self.since
+            sample = self.sample
+            self.current = target
+            self.since = now
+            self.sample = None
+            if elapsed >= self.threshold and origin is not self.hub:
+                if sample and sample[0] is origin:
+                    self._record(sample[3], elapsed, sample[2])
+                else:
+                    # a short stall can end before the sampler gets to it
+                    self._record(_context(origin), elapsed, [])
+        if self.previous is not None:
+            self.previous(event, args)
+
+    def _sample_loop(self):
+        try:
+            self._sample()
+        finally:
+            self.sampling.release()
+
+    def _sample(self):
+        while self.running:
+            _time.sleep(self.threshold/4)
+            current, since = self.current, self.since
+            if current is None or current is self.hub or self.sample is not None:
+                continue
+            if _time.time() - since < self.threshold:
+                continue
+            frame = sys._current_frames().get(self.thread)
+            # the greenthread may have yielded while we were looking
+            if frame is not None and self.current is current and self.since == since:
+                # the task context has to be picked up now, the
+                # greenthread may well have left its task by the time
+                # it yields
+                self.sample = (current, since, traceback.extract_stack(frame), _context(current))
+
+    def _record(self, context, elapsed, stack):
+        location = _location(stack)
+        key = (context, location)
+        offender = self.offenders.get(key)
+        if offender is None:
+            offender = Offender(context, location, stack)
+            self.offenders[key] = offender
+        offender.count += 1
+        offender.total += elapsed
+        if elapsed > offender.worst:
+            offender.worst = elapsed
+            offender.stack = stack
+        if self.verbose:
+            self.stream.write("forge: %s blocked the hub for %.3fs at %s\n%s" %
+                              (context or "(no task)", elapsed, location,
+                               "".join(traceback.format_list(stack))))
+
+    def report(self, limit=10):
+        """
+        Return a table of the worst offenders by total time spent
+        blocking the hub.
+        """
+        worst = sorted(self.offenders.values(), key=lambda o: o.total, reverse=True)[:limit]
+        if not worst:
+            return "no greenthread blocked the hub for more than %ss" % self.threshold
+        lines = ["greenthreads that blocked the hub for more than %ss:" % self.threshold,
+                 "  %8s %6s %8s  %s" % ("total", "count", "worst", "where")]
+        for o in worst:
+            lines.append("  %7.3fs %6d %7.3fs  %s (%s)" % (o.total, o.count, o.worst, o.location,
+                                                            o.context or "no task"))
+        return "\n".join(lines)
+
+def _context(glet):
+    exe = executor.running(glet)
+    return None if exe is None else exe.context
+
+def _location(stack):
+    """
+    Blame the innermost forge frame that isn't glue, or failing that
+    the innermost frame.
+    """
+    if not stack:
+        return "(unknown)"
+    blamed = stack[-1]
+    for frame in reversed(stack):
+        filename = os.path.abspath(frame[0])
+        if filename.startswith(_FORGE) and not filename.endswith(_GLUE):
+            blamed = frame
+            break
+    filename, lineno, name, _ = blamed
+    return "%s:%s in %s" % (os.path.relpath(filename), lineno, name)
+
+_DETECTOR = None
+
+def enable(threshold=THRESHOLD):
+    """
+    Start reporting stalls, and print a table of the worst offenders
+    at exit.
+    """
+    global _DETECTOR
+    if _DETECTOR is None:
+        _DETECTOR = Detector(threshold)
+        _DETECTOR.start()
+        atexit.register(_disable)
+    return _DETECTOR
+
+def _disable():
+    _DETECTOR.stop()
+    sys.stderr.write(_DETECTOR.report() + "\n")
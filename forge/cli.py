@@ -19,16 +19,18 @@ Forge CLI.
 from .tasks import (
     setup,
     task,
-    TaskError
+    TaskError,
+    DEBOUNCE,
+    METRICS
 )
 
 setup()
 
-import click, os
+import click, os, sys
 from dotenv import find_dotenv, load_dotenv
 
 import util
-from . import __version__
+from . import __version__, blocking
 from .core import Forge
 from .kubernetes import Kubernetes
 from .sops import edit_secret, view_secret
@@ -44,12 +46,20 @@ if ENV: load_dotenv(ENV)
 @click.option('--profile', envvar='FORGE_PROFILE')
 @click.option('--branch', envvar='FORGE_BRANCH')
 @click.option('--no-scan-base', is_flag=True, help="Do not scan for services in directory containing forge.yaml")
+@click.option('--metrics-file', type=click.Path(),
+              help="Write per task metrics to this file at exit, as JSON if it ends in .json, Prometheus text otherwise.")
+@click.option('--detect-blocking', envvar='FORGE_DEBUG_BLOCKING', is_flag=True,
+              help="Report tasks that hold up every other task by blocking the event loop.")
 @click.pass_context
-def forge(context, verbose, config, profile, branch, no_scan_base):
+def forge(context, verbose, config, profile, branch, no_scan_base, metrics_file, detect_blocking):
+    if detect_blocking:
+        blocking.enable()
     context.obj = Forge(verbose=verbose, config=config,
                         profile=None if profile is None else str(profile),
                         branch=None if branch is None else str(branch),
                         scan_base=not no_scan_base)
+    if metrics_file:
+        context.call_on_close(lambda: METRICS.write(metrics_file))
 
 @forge.command()
 @click.pass_obj
@@ -90,7 +100,9 @@ def setup(forge):
 @click.pass_context
 @click.option('-n', '--namespace', envvar='K8S_NAMESPACE', type=click.STRING)
 @click.option('--dry-run', is_flag=True)
-def build(ctx, namespace, dry_run):
+@click.option('--trace', type=click.Path(), help="Write a Chrome trace-event timeline of the build to this file.")
+@click.option('--timeout', type=click.FLOAT, help="Give up on the build after this many seconds.")
+def build(ctx, namespace, dry_run, trace, timeout):
     """Build deployment artifacts for a service.
 
     Deployment artifacts for a service consist of the docker
@@ -133,6 +145,8 @@ def build(ctx, namespace, dry_run):
     forge = ctx.obj
     forge.namespace = namespace
     forge.dry_run = dry_run
+    forge.trace = trace
+    forge.timeout = timeout
     if ctx.invoked_subcommand is None:
         forge.execute(forge.build)
 
@@ -188,7 +202,9 @@ def view(file_path):
 @click.option('-n', '--namespace', envvar='K8S_NAMESPACE', type=click.STRING)
 @click.option('--dry-run', is_flag=True, help="Run through the deploy steps without making changes.")
 @click.option('--prune', is_flag=True, help="Prune any resources not in the manifests.")
-def deploy(forge, namespace, dry_run, prune):
+@click.option('--trace', type=click.Path(), help="Write a Chrome trace-event timeline of the deploy to this file.")
+@click.option('--timeout', type=click.FLOAT, help="Give up on the deploy after this many seconds.")
+def deploy(forge, namespace, dry_run, prune, trace, timeout):
     """
     Build and deploy a service.
 
@@ -197,8 +213,36 @@ def deploy(forge, namespace, dry_run, prune):
     """
     forge.namespace = namespace
     forge.dry_run = dry_run
+    forge.trace = trace
+    forge.timeout = timeout
     forge.execute(lambda svc: forge.deploy(*forge.build(svc), prune=prune))
 
+@forge.command()
+@click.pass_obj
+@click.argument('goal', type=click.Choice(['deploy', 'build']), default='deploy')
+@click.option('-n', '--namespace', envvar='K8S_NAMESPACE', type=click.STRING)
+@click.option('--dry-run', is_flag=True, help="Run through the deploy steps without making changes.")
+@click.option('--prune', is_flag=True, help="Prune any resources not in the manifests.")
+@click.option('--debounce', type=click.FLOAT, default=DEBOUNCE, show_default=True,
+              help="Wait for changes to go quiet for this many seconds before acting on them.")
+def watch(forge, goal, namespace, dry_run, prune, debounce):
+    """
+    Build or deploy services whenever they change.
+
+    The watch command does a `forge deploy` (or a `forge build`), and
+    then watches the services for changes. Each burst of changes only
+    redoes what it has to for the services it touches:
+
+    \b
+     - a change to just the k8s directory re-renders the manifests
+     - a change to just the rebuild sources of the containers copies
+       them into the builders rather than building from scratch
+     - anything else builds the service in full
+    """
+    forge.namespace = namespace
+    forge.dry_run = dry_run
+    forge.watch(deploy=(goal == 'deploy'), prune=prune, debounce=debounce)
+
 @forge.command()
 @click.pass_obj
 def pull(forge):
@@ -372,6 +416,9 @@ def call_main():
         exit(e)
     except KeyboardInterrupt, e:
         exit(e)
+    finally:
+        # make sure buffered task output comes out ahead of any error
+        sys.stdout.flush()
 
 if __name__ == "__main__":
     call_main()
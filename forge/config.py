@@ -12,7 +12,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from .schema import Class, Field, Union, Constant, Map, Sequence, Boolean, Integer, String, Base64, SchemaError
+from .schema import Class, Field, Union, Constant, Map, Sequence, Boolean, Integer, Float, String, Base64, SchemaError
 
 class Registry(object):
 
@@ -103,10 +103,19 @@ PROFILE = Class(
     Field("registry", Union(DOCKER, GCR, ECR, LOCAL), default=None)
 )
 
+"""The default limits for the concurrency classes used by forge tasks."""
+CONCURRENCY_LIMITS = {
+    "docker_build": 2,
+    "registry_http": 32,
+    "kubectl": 8,
+    "git": 16
+}
+
 class Config(object):
 
     def __init__(self, search_path=None, registry=None, docker_repo=None, user=None, password=None, workdir=None,
-                 profiles=None, concurrency=None):
+                 profiles=None, concurrency=None, concurrency_limits=None, http_retries=None,
+                 http_rate_limits=None):
         self.search_path = search_path or ()
 
         if registry:
@@ -137,6 +146,10 @@ class Config(object):
             if p.registry is None:
                 p.registry = self.registry
         self.concurrency = concurrency
+        self.concurrency_limits = CONCURRENCY_LIMITS.copy()
+        self.concurrency_limits.update(concurrency_limits or {})
+        self.http_retries = http_retries
+        self.http_rate_limits = http_rate_limits or {}
 
 CONFIG = Class(
     "forge.yaml",
@@ -152,6 +165,12 @@ CONFIG = Class(
        Field("workdir", String(), default=None, docs="deprecated"),
        Field("profiles", Map(PROFILE), default=None, docs="A map keyed by profile-name of profile-specific settings."),
        Field("concurrency", Integer(), default=5, docs="This controls the maximum number of parallel builds."),
+       Field("concurrency-limits", Map(Integer()), "concurrency_limits", default=None,
+             docs="A map keyed by concurrency class of the maximum number of parallel operations of that class. The classes are docker_build, registry_http, kubectl, and git. Operations in these classes do not count against the overall concurrency limit."),
+       Field("http-retries", Integer(), "http_retries", default=None,
+             docs="The number of times an HTTP request is retried on connection errors and 429, 502, 503 or 504 responses. Defaults to 3."),
+       Field("http-rate-limits", Map(Float()), "http_rate_limits", default=None,
+             docs="A map keyed by host name of the maximum number of HTTP requests per second forge makes to that host."),
       ))
 )
 
@@ -27,10 +27,11 @@ import tasks
 
 from .docker import Docker, GCRDocker, ECRDocker, LocalDocker
 from .kubernetes import Kubernetes
-from .service import Discovery, Service
+from .service import Discovery, Service, get_version, MANIFESTS, REBUILD, BUILD
 
 from .jinja2 import renders
 from .istio import istio
+from . import trace
 
 from scout import Scout
 from . import __version__
@@ -50,6 +51,8 @@ class Forge(object):
         self.scan_base = scan_base
         self.namespace = None
         self.dry_run = False
+        self.trace = None
+        self.timeout = None
         self.terminal = Terminal()
         self.discovery = Discovery(self)
 
@@ -256,6 +259,21 @@ class Forge(object):
         self.push(service)
         return service, self.manifest(service)
 
+    @task()
+    def rebuild(self, service, plan):
+        """
+        Build a service by copying just the changed sources into each
+        container's builder, see Service.affected.
+        """
+        for container, changed in plan:
+            ctx = service.name if len(plan) == 1 else "%s[%s]" % (service.name, (container.index + 1))
+            with task.context(ctx), task.verbose(True):
+                container.build.go(changed)
+        task.sync()
+        self.baked.extend(c for c, _ in plan)
+        self.push(service)
+        return service, self.manifest(service)
+
     @task()
     def deploy(self, service, k8s_dir, prune=False):
         self.kube.apply(k8s_dir, prune=({"forge.service": service.name, "forge.profile": service.profile}
@@ -284,6 +302,9 @@ class Forge(object):
 
         self.kube = Kubernetes(namespace=self.namespace, dry_run=self.dry_run)
         tasks.executor.resize(conf.concurrency)
+        for name, size in conf.concurrency_limits.items():
+            tasks.executor.limit(name, size)
+        tasks.http_config(retries=conf.http_retries, rate_limits=conf.http_rate_limits)
 
     def load_services(self):
         start = util.search_parents("service.yaml")
@@ -316,25 +337,132 @@ class Forge(object):
 
     def execute(self, goal):
         self.load_config()
+        exe = self.run_goals(lambda: [(name, goal) for name in self.load_services()])
+        if exe.result is ERROR:
+            raise SystemExit(1)
+        else:
+            self.summary()
 
+    def run_goals(self, targets):
+        """
+        Run a goal for each of the (service name, goal) pairs returned
+        by *targets*, and return the result of the whole run. The
+        targets are computed from within the run, so they can use
+        tasks themselves.
+        """
         @task(context="{0}")
-        def service(name):
+        def service(name, goal):
             svc = self.discovery.services[name]
-            goal(svc)
+            with task.fields(service=name):
+                goal(svc)
 
-        @task(context="forge")
+        # nothing but the trace needs the results of successful tasks
+        # once they are done, so don't hang on to them otherwise
+        @task(context="forge", timeout=self.timeout,
+              retain=tasks.RETAIN_ALL if self.trace else tasks.RETAIN_ERRORS)
         def root():
             with task.verbose(self.verbose):
                 task.info("CONFIG: %s" % self.config)
-                for name in self.load_services():
-                    service.go(name)
+                for name, goal in targets():
+                    service.go(name, goal)
 
         exe = root.run()
-        if exe.result is ERROR:
-            raise SystemExit(1)
+        if self.trace:
+            trace.write(exe, self.trace)
+        return exe
+
+    def watch(self, deploy=True, prune=False, debounce=tasks.DEBOUNCE):
+        """
+        Build, and optionally deploy, every service, then keep doing so
+        for just the services whose files change, redoing as little as
+        each change allows.
+        """
+        self.load_config()
+        if deploy:
+            full = lambda svc: self.deploy(*self.build(svc), prune=prune)
         else:
+            full = self.build
+
+        exe = self.run_goals(lambda: [(name, full) for name in self.load_services()])
+        if exe.result is not ERROR:
             self.summary()
 
+        roots = sorted(svc.root for svc in self.discovery.services.values() if not svc.shallow)
+        # a nested service is watched along with its parent
+        roots = [r for i, r in enumerate(roots) if not any(r.startswith(o + os.sep) for o in roots[:i])]
+        for paths in tasks.watch_changes(roots, debounce, ignore=_ignored):
+            self.baked, self.pushed, self.rendered, self.deployed = [], [], [], []
+            forget_lookups()
+            exe = self.run_goals(lambda: self.plan(paths, full, deploy, prune))
+            if exe.result is not ERROR and (self.baked or self.rendered):
+                self.summary()
+
+    def plan(self, paths, full, deploy, prune):
+        """
+        Work out which services own the changed *paths* and pick the
+        cheapest goal that brings each of them up to date.
+        """
+        services = sorted(self.discovery.services.values(), key=lambda s: len(s.root), reverse=True)
+        owned = OrderedDict()
+        for path in sorted(paths):
+            for svc in services:
+                if path.startswith(svc.root + os.sep):
+                    owned.setdefault(svc, set()).add(os.path.relpath(path, svc.root))
+                    break
+
+        goals = []
+        for svc, changed in owned.items():
+            fresh = None
+            if changed - set(svc.files) or \
+               any(not os.path.exists(os.path.join(svc.root, p)) for p in changed):
+                # files came or went, but they may just be ignored ones
+                fresh = self.rescan(svc)
+                if fresh.files != svc.files or fresh.dockerfiles != svc.dockerfiles:
+                    stage, plan = BUILD, ()
+                else:
+                    changed &= set(svc.files)
+                    if not changed:
+                        continue
+                    stage, plan = svc.affected(changed)
+            else:
+                stage, plan = svc.affected(changed)
+
+            if stage == MANIFESTS:
+                # the images haven't changed, so the service keeps its
+                # version and the manifests keep pointing at them
+                goal = self.manifest
+                if deploy:
+                    goal = lambda svc: self.deploy(svc, self.manifest(svc), prune=prune)
+            elif stage == REBUILD:
+                svc._version = None
+                goal = lambda svc, plan=plan: self.rebuild(svc, plan)
+                if deploy:
+                    goal = lambda svc, plan=plan: self.deploy(*self.rebuild(svc, plan), prune=prune)
+            else:
+                svc = self.replace(svc, fresh or self.rescan(svc))
+                goal = full
+
+            task.echo("%s: %s changed, %s" % (svc.name, ", ".join(sorted(changed)), stage))
+            goals.append((svc.name, goal))
+        return goals
+
+    def rescan(self, svc):
+        """
+        Discover a service afresh, picking up changes to its descriptor
+        and to the set of files that make it up.
+        """
+        for found in self.discovery.search(svc.root):
+            if found.descriptor == svc.descriptor:
+                return found
+        raise TaskError("service went away: %s" % svc.name)
+
+    def replace(self, old, new):
+        services = self.discovery.services
+        if services.get(old.name) is old:
+            del services[old.name]
+        services[new.name] = new
+        return new
+
     @task(context="forge")
     def summary(self):
         task.echo()
@@ -351,6 +479,23 @@ class Forge(object):
         if self.deployed:
             task.echo(color("deployed: ") + ", ".join(s.name for s, k in self.deployed))
 
+def _ignored(path):
+    # forge's own output and git's bookkeeping change as a side effect
+    # of building, so they must never trigger a build
+    parts = path.split(os.sep)
+    return ".forge" in parts or ".git" in parts
+
+def forget_lookups():
+    """
+    Drop the memoized answers to questions about the outside world:
+    the version of each service, which can move with a new commit, and
+    which images a registry has, which can change when someone else
+    pushes. Within one build they hold still, but a watch lives across
+    many builds.
+    """
+    for fun in (get_version, Docker.remote_exists, ECRDocker.remote_exists):
+        fun.clear()
+
 def get_docker(registry):
     if registry.type == "ecr":
         return ECRDocker(
@@ -12,25 +12,122 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import logging, sys, traceback
-from eventlet.queue import Queue
+import eventlet, logging
+from eventlet.green import time
+from eventlet.queue import Queue, Full
+from .metrics import Histogram
+from .tasks import executor, TaskError, ERROR, RETAIN_ERRORS
+
+# what schedule does when the queue is full
+BLOCK = "block"
+REJECT = "reject"
+
+class Rejected(TaskError):
+
+    """
+    Raised by schedule when the queue is full and the dispatcher
+    rejects rather than blocks.
+    """
+
+    pass
 
 class Dispatcher(object):
 
-    def __init__(self):
-        self.queue = Queue()
+    """
+    Runs scheduled jobs on a pool of worker greenthreads. Jobs wait in
+    a queue of at most *maxsize* jobs (unbounded by default) for one
+    of the *workers* to pick them up. Once the queue is full,
+    scheduling a job either blocks until there is room or raises
+    Rejected, depending on *policy*.
+
+    Each job runs under its own executor, so any errors, including
+    those of tasks it launches, are logged with the usual report. The
+    time jobs spend queued and running is collected in histograms,
+    see stats().
+
+        dispatcher = Dispatcher(workers=4, maxsize=100, policy=REJECT)
+        dispatcher.start()
+        dispatcher.schedule(build, "my-service")
+    """
+
+    def __init__(self, workers=1, maxsize=None, policy=BLOCK, name="dispatcher"):
+        assert policy in (BLOCK, REJECT), policy
+        self.queue = Queue(maxsize)
+        self.workers = workers
+        self.maxsize = maxsize
+        self.policy = policy
+        self.name = name
+        self.threads = []
+        self.running = 0
+        self.dispatched = 0
+        self.errors = 0
+        self.rejected = 0
+        self.wait_time = Histogram()
+        self.run_time = Histogram()
+
+    def start(self):
+        """
+        Spawn the workers.
+        """
+        while len(self.threads) < self.workers:
+            self.threads.append(eventlet.spawn(self.work))
+
+    def stop(self):
+        """
+        Kill the workers, jobs that are still queued stay queued.
+        """
+        threads, self.threads = self.threads, []
+        for t in threads:
+            t.kill()
+
+    def join(self):
+        """
+        Wait until every job scheduled so far has been dispatched.
+        """
+        with executor._released_slot():
+            self.queue.join()
 
     def dispatch(self):
+        fun, args, queued = self.queue.get()
         try:
-            fun, args = self.queue.get()
+            self.running += 1
+            self.wait_time.observe(time.time() - queued)
             logging.info("dispatching %s(%s)" % (fun.__name__, ", ".join(repr(a) for a in args)))
-            fun(*args)
-        except:
-            logging.error(traceback.format_exc())
+            result = executor(self.name, retain=RETAIN_ERRORS).run(fun, *args)
+            if result.started is not None:
+                self.run_time.observe(result.finished - result.started)
+            self.dispatched += 1
+            if result.value is ERROR:
+                self.errors += 1
+                logging.error(result.report(autocolor=False))
+            return result
+        finally:
+            self.running -= 1
+            self.queue.task_done()
 
     def work(self):
         while True:
             self.dispatch()
 
     def schedule(self, fun, *args):
-        self.queue.put((fun, args))
+        item = (fun, args, time.time())
+        if self.policy == REJECT:
+            try:
+                self.queue.put_nowait(item)
+            except Full:
+                self.rejected += 1
+                raise Rejected("%s: queue full, rejected %s" % (self.name, fun.__name__))
+        else:
+            with executor._released_slot():
+                self.queue.put(item)
+
+    def stats(self):
+        return {"workers": len(self.threads),
+                "running": self.running,
+                "depth": self.queue.qsize(),
+                "maxsize": self.maxsize,
+                "dispatched": self.dispatched,
+                "errors": self.errors,
+                "rejected": self.rejected,
+                "wait_time": self.wait_time.json(),
+                "run_time": self.run_time.json()}
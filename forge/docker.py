@@ -13,7 +13,7 @@
 # limitations under the License.
 
 import base64, boto3, os, urllib2, hashlib
-from tasks import task, TaskError, get, sh, Secret
+from tasks import task, TaskError, get, sh, Secret, CAPTURE_TAIL
 
 
 class DockerImageBuilderError(TaskError):
@@ -46,7 +46,6 @@ def image(registry, namespace, name, version):
 class DockerBase(object):
 
     def __init__(self):
-        self.image_cache = {}
         self.logged_in = False
 
     def _login(self):
@@ -54,7 +53,7 @@ class DockerBase(object):
             self._do_login()
             self.logged_in = True
 
-    @task()
+    @task(singleflight=True)
     def local_exists(self, name, version):
         return bool(sh("docker", "images", "-q", self.image(name, version)).output)
 
@@ -69,7 +68,7 @@ class DockerBase(object):
     @task()
     def pull(self, image):
         self._login()
-        sh("docker", "pull", image)
+        sh("docker", "pull", image, capture=CAPTURE_TAIL)
 
     @task()
     def tag(self, source, name, version):
@@ -84,11 +83,11 @@ class DockerBase(object):
         self._login()
         self._create_repo(name)
         img = self.image(name, version)
-        self.image_cache.pop(img, None)
-        sh("docker", "push", img)
+        self.remote_exists.forget(name, version)
+        sh("docker", "push", img, capture=CAPTURE_TAIL)
         return img
 
-    @task()
+    @task(concurrency="docker_build")
     def build(self, directory, dockerfile, name, version, args, builder=None):
         args = args or {}
 
@@ -102,7 +101,8 @@ class DockerBase(object):
         img = self.image(name, version)
 
         cmd = DockerImageBuilder.get_cmd_from_name(builder)
-        sh(*cmd(directory, dockerfile, img, buildargs))
+        # only the end of a build log is of any use in an error message
+        sh(*cmd(directory, dockerfile, img, buildargs), capture=CAPTURE_TAIL, tail=200)
 
         return img
 
@@ -234,7 +234,7 @@ class Docker(DockerBase):
         if not self._run_login and not self.user:
             raise TaskError("unable to locate docker credentials, please run `docker login %s`" % self.registry)
 
-    @task()
+    @task(cache=True)
     def image(self, name, version):
         return image(self.registry, self.namespace, name, version)
 
@@ -268,22 +268,17 @@ class Docker(DockerBase):
     def repo_get(self, name, api):
         return self.registry_get("%s/%s/%s" % (self.namespace, name, api))
 
-    @task()
+    # tags are immutable, so the answer only changes when we push
+    @task(concurrency="registry_http", cache=True, singleflight=True)
     def remote_exists(self, name, version):
         self._login()
-        img = self.image(name, version)
-        if img in self.image_cache:
-            return self.image_cache[img]
-
         response = self.repo_get(name, "manifests/%s" % version)
         result = response.json()
         # v1 and v2 manifest schemas look a bit different
         if 'fsLayers' in result or 'layers' in result:
-            self.image_cache[img] = True
             return True
         elif 'errors' in result and result['errors']:
             if result['errors'][0]['code'] in ('MANIFEST_UNKNOWN', 'NAME_UNKNOWN'):
-                self.image_cache[img] = False
                 return False
         raise TaskError(response.content)
 
@@ -333,7 +328,7 @@ class ECRDocker(DockerBase):
         proxy = data['proxyEndpoint']
         sh("docker", "login", "-u", user, "-p", Secret(password), proxy)
 
-    @task()
+    @task(cache=True)
     def image(self, name, version):
         return "{}/{}:{}".format(self.url, name, version)
         #return image(self.registry, self.namespace, name, version)
@@ -345,7 +340,7 @@ class ECRDocker(DockerBase):
         except self.ecr.exceptions.RepositoryAlreadyExistsException, e:
             task.info('repository {} already exists'.format(name))
 
-    @task()
+    @task(concurrency="registry_http", cache=True, singleflight=True)
     def remote_exists(self, name, version):
         try:
             task.info('checking for remote version: %r' % version)
@@ -12,14 +12,17 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import eventlet, sys
+import atexit, eventlet, greenlet, itertools, linecache, sys, weakref
 from eventlet.corolocal import local
 from eventlet.green import time
+from collections import OrderedDict
 from contextlib import contextmanager
+from .backends import BACKENDS
 from .sentinel import Sentinel
 
 traceback = eventlet.import_patched('traceback')
 output = eventlet.import_patched('forge.output')
+_thread = eventlet.patcher.original('thread')
 
 """A sentinal value used to indicate that the task is not yet complete."""
 PENDING = Sentinel("PENDING")
@@ -27,6 +30,37 @@ PENDING = Sentinel("PENDING")
 """A sentinal value used to indicate that the task terminated with an error of some kind."""
 ERROR = Sentinel("ERROR")
 
+# stack capture modes
+STACK_FULL = "full"
+STACK_LAZY = "lazy"
+STACK_OFF = "off"
+
+# result retention modes
+RETAIN_ALL = "all"
+RETAIN_ERRORS = "errors"
+
+class TaskCancelled(BaseException):
+
+    """
+    Raised inside a task when it is cancelled. This derives from
+    BaseException so that code catching Exception doesn't accidentally
+    swallow the cancellation and carry on.
+    """
+
+    report_traceback = False
+
+    def __init__(self, message="cancelled"):
+        BaseException.__init__(self, message)
+
+class TaskTimeout(TaskCancelled):
+
+    """
+    Raised inside a task when it runs past its deadline.
+    """
+
+    def __init__(self, timeout):
+        TaskCancelled.__init__(self, "timed out after %ss" % timeout)
+
 class ChildError(Exception):
 
     """
@@ -42,19 +76,58 @@ class ChildError(Exception):
 
 class Result(object):
 
+    """
+    The outcome of a single executor invocation.
+
+    Results form a tree that mirrors how invocations are nested. Rather
+    than walking that tree whenever we need to know whether a subtree
+    is finished or has errors, every result keeps a tally for its
+    subtree that is folded into its parent as it finishes. This keeps
+    waiting and reporting proportional to the number of errors rather
+    than the size or depth of the tree.
+
+    Depending on the retention mode of the executor, successful
+    subtrees may be dropped from the tree once they are no longer
+    needed, see executor for details.
+    """
+
+    __slots__ = ("executor", "parent", "children", "seq", "size", "_pending", "_done",
+                 "_errored", "_leaf_errors", "_leaf", "name", "value", "exc_info",
+                 "started", "finished", "thread", "_stack", "_frames", "_recovered",
+                 "_cancelled")
+
+    _SEQUENCE = itertools.count()
+
     def __init__(self, executor, parent):
         self.executor = executor
         self.parent = parent
         self.children = []
+        self.seq = next(self._SEQUENCE)
+        # the number of results in this subtree, this only includes
+        # the subtrees of children once they have finished
+        self.size = 1
+        # the number of children that have not yet finished
+        self._pending = 0
+        self._done = None
+        # children that errored, and leaf errors anywhere beneath us
+        self._errored = []
+        self._leaf_errors = []
+        self._leaf = False
         if self.parent:
             self.parent.children.append(self)
-        self.child_errors = 0
+            self.parent.size += 1
+            self.parent._pending += 1
 
+        self.name = None
         self.value = PENDING
         self.exc_info = None
+        self.started = None
+        self.finished = None
         self.thread = None
-        self.stack = None
+        self._stack = None
+        self._frames = None
         self._recovered = False
+        self._cancelled = None
 
     @property
     def exception(self):
@@ -63,25 +136,110 @@ class Result(object):
     @exception.setter
     def exception(self, exc_info):
         self.exc_info = exc_info
+        # An exception that was propagated from one of our children is
+        # reported at the child, so we only count as a leaf error if
+        # the exception originated here.
+        self._leaf = not issubclass(exc_info[0], ChildError) and \
+                     not any(ch.exc_info[1] == exc_info[1] for ch in self._errored)
         if self.parent:
-            self.parent.child_errors += 1
+            self.parent._errored.append(self)
+
+    def _finish(self):
+        """
+        Called once this result and all its descendants are done. A
+        result never finishes before its children, so folding our
+        tallies into our parent here is enough to keep every ancestor
+        up to date without ever walking the tree.
+        """
+        self.finished = time.time()
+        parent = self.parent
+        if parent is not None:
+            parent.size += self.size - 1
+            if self._leaf:
+                parent._leaf_errors.append(self)
+            parent._leaf_errors.extend(self._leaf_errors)
+            parent._pending -= 1
+            if parent._pending == 0 and parent._done is not None:
+                parent._done.send()
+                parent._done = None
+
+    def _compact(self):
+        """
+        Drop the successful children of a finished result from the
+        tree. Their contribution to size and errors has already been
+        folded into this result, so report() is unaffected. A
+        synchronous invocation has already been consumed by the time it
+        finishes, so it is also dropped from its own parent right away.
+        """
+        if self.children:
+            self.children = [ch for ch in self.children if not ch._succeeded()]
+        if self._succeeded():
+            # the stack is only ever needed to report an error
+            self._stack = None
+            self._frames = None
+            if self.parent is not None and not self.executor.async:
+                siblings = self.parent.children
+                if siblings and siblings[-1] is self:
+                    siblings.pop()
+
+    def _succeeded(self):
+        return self.value is not ERROR and not self._leaf_errors
 
     # XXX: deprecated
     @property
     def result(self):
         return self.value
 
-    def _capture_stack(self):
-        self.stack = traceback.extract_stack()
+    def _capture_stack(self, mode=STACK_FULL):
+        if mode == STACK_FULL:
+            self._stack = traceback.extract_stack(sys._getframe(1))
+        elif mode == STACK_LAZY:
+            # Only remember the code objects and line numbers, the
+            # expensive part of extract_stack is looking up source
+            # lines, and we only need those if something goes wrong.
+            frames = []
+            f = sys._getframe(1)
+            while f is not None:
+                frames.append((f.f_code, f.f_lineno))
+                f = f.f_back
+            self._frames = frames
+        else:
+            self._stack = []
+
+    @property
+    def stack(self):
+        if self._stack is None and self._frames is not None:
+            stack = []
+            for code, lineno in reversed(self._frames):
+                filename = code.co_filename
+                linecache.checkcache(filename)
+                line = linecache.getline(filename, lineno)
+                stack.append((filename, lineno, code.co_name, line.strip() if line else None))
+            self._stack = stack
+            self._frames = None
+        return self._stack
 
     def wait(self):
-        if self.value is PENDING:
-            if self.thread not in (None, eventlet.getcurrent()):
-                self.thread.wait()
-        for ch in self.children:
-            ch.wait()
-        if self.child_errors > 0 and self.value is not ERROR:
-            errors = [e for e in self.leaf_errors if not e._recovered]
+        self._wait(True)
+
+    def _wait(self, release):
+        running = self.value is PENDING and self.thread not in (None, eventlet.getcurrent())
+        if running or self._pending > 0:
+            # only give up our pool slot if we are really going to block
+            with executor._released_slot(release):
+                if running:
+                    try:
+                        self.thread.wait()
+                    except TaskCancelled:
+                        # the thread was cancelled before it got going,
+                        # cancel() has already recorded that for us
+                        pass
+                if self._pending > 0:
+                    if self._done is None:
+                        self._done = eventlet.event.Event()
+                    self._done.wait()
+        if self._leaf_errors and self.value is not ERROR:
+            errors = [e for e in self._leaf_errors if not e._recovered]
             if errors:
                 self.value = ERROR
                 self.exception = (ChildError, ChildError(self, self.leaf_errors), None)
@@ -93,39 +251,76 @@ class Result(object):
         else:
             return self.value
 
+    def cancel(self):
+        """
+        Cancel this invocation along with everything it launched that
+        is still running. Each running invocation has TaskCancelled
+        raised inside it, and invocations that have not started yet
+        never run at all. Cancelling a finished result does nothing.
+        """
+        exc = TaskCancelled()
+        # cancel from the bottom up so that nothing gets left waiting
+        # on a subtree that nobody is going to finish
+        for r in reversed(list(self.traversal)):
+            r._cancel(exc)
+
+    def _cancel(self, exc):
+        if self.finished is not None:
+            return
+        # code that survives the cancellation, e.g. because it was
+        # delivered to a nested invocation, can't launch anything new
+        self._cancelled = exc
+        thread = self.thread
+        # a thread of None means we are either synchronous, in which
+        # case an ancestor's thread gets cancelled, or already done
+        # and just waiting on children
+        if self.finished is not None or thread is None or thread is eventlet.getcurrent():
+            return
+        if not thread and not thread.dead:
+            # never started, so there is no do_run to finish up for us
+            thread.kill(exc)
+            self.thread = None
+            self.value = ERROR
+            self.exception = (type(exc), exc, None)
+            self._finish()
+            if self.executor.on_done is not None:
+                self.executor.on_done(self)
+        else:
+            thread.kill(exc)
+
+    def is_cancelled(self):
+        return self.exc_info is not None and issubclass(self.exc_info[0], TaskCancelled)
+
     def recover(self):
         for r in self.traversal:
             r._recovered = True
 
     @property
     def traversal(self):
-        yield self
-        for c in self.children:
-            for d in c.traversal:
-                yield d
+        todo = [self]
+        while todo:
+            r = todo.pop()
+            yield r
+            todo.extend(reversed(r.children))
 
     @property
     def errors(self):
-        return [r for r in self.traversal if r.is_leaf_error()]
+        errors = self.leaf_errors
+        if self._leaf:
+            errors.insert(0, self)
+        return errors
 
     @property
     def leaf_errors(self):
-        return [ch for ch in self.traversal if ch is not self and ch.is_leaf_error()]
+        return sorted(self._leaf_errors, key=lambda r: r.seq)
 
     def is_leaf_error(self):
-        if self.result is ERROR:
-            if issubclass(self.exception[0], ChildError):
-                return False
-            for ch in self.children:
-                if ch.value is ERROR and ch.exception[1] == self.exception[1]:
-                    return False
-            return True
-        else:
-            return False
+        return self._leaf
 
     def is_signal(self, (filename, lineno, funcname, text)):
-        noise = {"forge/executor.py": ("run", "do_run", "_capture_stack"),
-                 "forge/tasks.py": ("go", "__call__"),
+        noise = {"forge/executor.py": ("run", "do_run", "_pooled_run"),
+                 "forge/backends.py": ("call",),
+                 "forge/tasks.py": ("go", "__call__", "_launch"),
                  "eventlet/greenthread.py": ("main",)}
         for k, v in noise.items():
             if filename.endswith(k) and funcname in v:
@@ -161,29 +356,44 @@ class Result(object):
         return executor.MUXER.terminal
 
     def report(self, autocolor=True):
-        total = 0
+        total = self.size
         errors = []
-        for r in self.traversal:
-            total += 1
-            if r.is_leaf_error():
-                exc = r.exception[1]
-                indent = "  "
-                if getattr(exc, "report_traceback", True):
-                    tb = "\n\n" + r.get_traceback().strip()
-                    errors.append("%s%s: unexpected error%s" % (indent, r.executor.name,
-                                                                tb.replace("\n", "\n  " + indent)))
-                else:
-                    errors.append("%s%s: %s" % (indent, r.executor.context, exc))
+        cancelled = []
+        # followers of a single flight raise the leader's exception, it
+        # is reported once
+        seen = set()
+        for r in self.errors:
+            if r._recovered:
+                continue
+            exc = r.exception[1]
+            indent = "  "
+            if r.is_cancelled():
+                cancelled.append("%s%s: %s" % (indent, r.executor.context, exc))
+                continue
+            if id(exc) in seen:
+                continue
+            seen.add(id(exc))
+            if getattr(exc, "report_traceback", True):
+                tb = "\n\n" + r.get_traceback().strip()
+                errors.append("%s%s: unexpected error%s" % (indent, r.executor.name,
+                                                            tb.replace("\n", "\n  " + indent)))
+            else:
+                errors.append("%s%s: %s" % (indent, r.executor.context, exc))
 
         if autocolor:
-            if errors:
+            if errors or cancelled:
                 color = self.terminal.bold_red
             else:
                 color = self.terminal.green
         else:
             color = lambda x: x
 
-        result = "\n".join(["%s tasks run, %s errors" % (total, len(errors))] + errors)
+        summary = "%s tasks run, %s errors" % (total, len(errors))
+        if cancelled:
+            summary += ", %s cancelled" % len(cancelled)
+            errors.append("cancelled:")
+            errors.extend(cancelled)
+        result = "\n".join([summary] + errors)
 
         return "\n".join([color(line) for line in result.splitlines()])
 
@@ -193,14 +403,74 @@ class Result(object):
         else:
             return repr(self.exception[1])
 
+class _Block(object):
+
+    """
+    The output from a single context that has not been written yet.
+    """
+
+    def __init__(self, color):
+        self.color = color
+        self.chunks = []
+        self.size = 0
+        self.stale = False
+
+    def append(self, bytes):
+        self.chunks.append(bytes)
+        self.size += len(bytes)
+        self.stale = False
+
+    def take(self, partial):
+        """
+        Remove and return the buffered output. Unless *partial* is set,
+        any trailing incomplete line is kept for later so that a block
+        never ends in the middle of a line.
+        """
+        data = "".join(self.chunks)
+        if not partial:
+            idx = data.rfind("\n") + 1
+            data, rest = data[:idx], data[idx:]
+        else:
+            rest = ""
+        self.chunks = [rest] if rest else []
+        self.size = len(rest)
+        return data
+
 class _Muxer(object):
 
-    def __init__(self, stream):
+    """
+    Multiplexes the output of concurrently running executors onto a
+    single stream.
+
+    Output is buffered per executor context and written out a whole
+    block at a time, either periodically or once a context has
+    buffered enough, by a single writer greenthread. Explicitly
+    flushing writes out everything immediately. This keeps the output
+    of parallel tasks grouped under a single header rather than
+    interleaved line by line.
+    """
+
+    INTERVAL = 0.1
+    THRESHOLD = 64*1024
+
+    def __init__(self, stream, interval=INTERVAL, threshold=THRESHOLD):
         assert not isinstance(stream, _Muxer)
         self.previous = None
         self.stream = stream
         self.terminal = output.Terminal()
-        self.default_color = lambda x: x
+        self.styling = self.terminal.does_styling
+        self.default_color = _plain
+        self.interval = interval
+        self.threshold = threshold
+        self.blocks = OrderedDict()
+        self.writer = None
+        self.wakeup = eventlet.event.Event()
+        # only the thread running the hub may touch the writer, output
+        # from other threads is picked up on the next round
+        self.thread = _thread.get_ident()
+        # a real lock, since tasks on the thread backend write here
+        # too, it is never held across a switch
+        self.lock = _thread.allocate_lock()
 
     def write(self, bytes):
         exe = executor.current()
@@ -210,21 +480,114 @@ class _Muxer(object):
         else:
             context = exe.context
             color = exe.color
+        if isinstance(bytes, unicode):
+            bytes = bytes.encode("UTF-8")
+        with self.lock:
+            block = self.blocks.get(context)
+            if block is None:
+                block = _Block(color)
+                self.blocks[context] = block
+            block.append(bytes)
+        if _thread.get_ident() != self.thread:
+            return
+        if self.writer is None:
+            self.writer = eventlet.spawn(self._write_loop)
+        elif block.size >= self.threshold and not self.wakeup.ready():
+            self.wakeup.send()
+
+    def _write_loop(self):
+        try:
+            while self.blocks:
+                with eventlet.Timeout(self.interval, False):
+                    self.wakeup.wait()
+                if self.wakeup.ready():
+                    self.wakeup = eventlet.event.Event()
+                self._drain(False)
+        finally:
+            self.writer = None
+
+    def _drain(self, partial):
+        """
+        Write out every buffered block. Incomplete lines are held back
+        for one round unless *partial* is set.
+        """
+        taken = []
+        with self.lock:
+            for context, block in self.blocks.items():
+                data = block.take(partial or block.stale)
+                if data:
+                    taken.append((context, block.color, data))
+                if block.size:
+                    block.stale = True
+                else:
+                    del self.blocks[context]
+        for context, color, data in taken:
+            self._emit(context, color, data)
+
+    def _emit(self, context, color, data):
         if self.previous != context:
             if context is not None:
                 self.stream.write((color(u"\u2554\u2550") + color(unicode(context)) + u"\n").encode("UTF-8"))
-        if isinstance(bytes, unicode):
-            bytes = bytes.encode("UTF-8")
-        self.stream.write(bytes)
+        self.stream.write(data)
         self.previous = context
 
     def flush(self):
+        self._drain(True)
         self.stream.flush()
 
+    def _flush_at_exit(self):
+        # by now whoever owns the stream may well have closed it
+        if getattr(self.stream, "closed", False):
+            return
+        try:
+            self.flush()
+        except (ValueError, IOError):
+            pass
+
     def isatty(self):
         return self.stream.isatty()
 
-_POOL = eventlet.greenpool.GreenPool()
+def _plain(text):
+    return text
+
+class _Pool(eventlet.greenpool.GreenPool):
+
+    """
+    The shared pool. Tasks blocked waiting on other tasks lend their
+    slots back to it (see executor._released_slot), so every slot being
+    free no longer means that nothing is running.
+    """
+
+    def _spawn_done(self, coro):
+        self.sem.release()
+        if coro is not None:
+            self.coroutines_running.remove(coro)
+        if self.sem.balance == self.size + executor.LENT:
+            self.no_coros_running.send(None)
+
+_POOL = _Pool()
+
+class _Limit(object):
+
+    def __init__(self, size):
+        self.size = size
+        self.sem = eventlet.semaphore.Semaphore(size)
+
+    def resize(self, size):
+        if size > self.size:
+            # releasing, rather than bumping the counter, wakes anybody
+            # already waiting for a permit
+            for _ in range(size - self.size):
+                self.sem.release()
+        else:
+            # this is the same trick GreenPool.resize uses, a negative
+            # counter simply means released permits will not be
+            # reissued until we are back under the new size
+            self.sem.counter += size - self.size
+        self.size = size
+
+"""The limits for named concurrency classes, keyed by class name."""
+_LIMITS = {}
 
 
 class executor(object):
@@ -293,9 +656,71 @@ class executor(object):
                   File "<stdin>", line 4, in my_code
                   File "<stdin>", line 4, in <lambda>
                 ZeroDivisionError: integer division or modulo by zero
+
+    Capturing the stack for every invocation is not free, so the
+    executor supports three capture modes that are inherited by
+    nested executors:
+
+        # STACK_FULL extracts and formats the stack up front
+        # STACK_LAZY (the default) only records code locations and
+        #            formats them if a traceback is actually needed
+        # STACK_OFF omits the launching stack from tracebacks entirely
+        exe = executor("quiet-executor", async=True, stack=STACK_OFF)
+
+    Every result is normally kept in the result tree for as long as
+    the tree is around. For long running or very large runs the
+    RETAIN_ERRORS mode drops the results of successful invocations
+    from the tree once their caller is done with them. The tree then
+    only holds enough to produce a report, the traversal, children
+    and trace export of a compacted tree are incomplete:
+
+        exe = executor("big-build", retain=RETAIN_ERRORS)
+
+    An executor can be given a timeout in seconds. Its deadline is
+    inherited by everything it runs, so nested invocations can
+    tighten the deadline but never extend it. An invocation that is
+    still running at the deadline has TaskTimeout raised inside it,
+    and any result can be cancelled explicitly:
+
+        exe = executor("push", async=True, timeout=300)
+        result = exe.run(push_image)
+        ...
+        result.cancel()
+
+    An on_done callback is called with the result of each invocation
+    once it and everything it launched have finished.
+
+    Cancellation is delivered to the greenthread running an
+    invocation. Code on the thread or process backends stops being
+    waited for but is not interrupted.
+
+    By default the executor runs code on an eventlet greenthread,
+    which is great for I/O but means CPU bound work serializes on a
+    single core. The backend option ships the function itself off to
+    a real thread or process pool while the result is still tracked
+    by the executor as usual:
+
+        exe = executor("hasher", async=True, backend="thread")
+        result = exe.run(hashlib.sha1, data)
+
+    Code running on the thread or process backends runs outside of
+    the executor and so must not launch tasks of its own.
+
+    Invocations can also be tagged with a named concurrency class.
+    Each class has its own limit on how many invocations may run at
+    once, and asynchronous invocations in a limited class do not
+    compete with everything else for slots in the shared pool:
+
+        executor.limit("docker_build", 2)
+        exe = executor("build", async=True, concurrency="docker_build")
     """
 
     CURRENT = local()
+    # the same, but keyed by greenthread so that it can be looked up
+    # from outside of the greenthread, this is only kept up to date
+    # while TRACK is set since only the blocking detector needs it
+    RUNNING = weakref.WeakKeyDictionary()
+    TRACK = False
     MUXER = _Muxer(sys.stdout)
     COLORS = [getattr(MUXER.terminal, n) for n in ("white",
                                                    "cyan",
@@ -311,9 +736,13 @@ class executor(object):
                                                    "white_on_magenta",
                                                    "bold_white_on_magenta")]
     ALLOCATED = {}
+    # the number of pool slots lent back by waiting tasks
+    LENT = 0
 
     @classmethod
     def allocate_color(cls, name):
+        if not cls.MUXER.styling:
+            return _plain
         if name in cls.ALLOCATED:
             return cls.ALLOCATED[name]
         else:
@@ -329,6 +758,15 @@ class executor(object):
     def current_result(cls):
         return getattr(cls.CURRENT, "result", None)
 
+    @classmethod
+    def running(cls, glet):
+        """
+        Return the executor the given greenthread is running, if any.
+        Unlike current, this works from any thread or greenthread, but
+        only while TRACK is set.
+        """
+        return cls.RUNNING.get(glet)
+
     @classmethod
     def setup(cls):
         eventlet.sleep() # workaround for import cycle: https://github.com/eventlet/eventlet/issues/401
@@ -339,23 +777,85 @@ class executor(object):
             getpass.os = eventlet.patcher.original('os') # workaround for https://github.com/eventlet/eventlet/issues/340
 
         sys.stdout = cls.MUXER
+        atexit.register(cls.MUXER._flush_at_exit)
 
     @classmethod
     def resize(cls, size):
+        # lent slots are handed out on top of the size, so they don't
+        # need adjusting here
         _POOL.resize(size)
 
-    def __init__(self, name = None, async=False):
+    @classmethod
+    def limit(cls, name, size):
+        """
+        Set the maximum number of concurrently running invocations for
+        the named concurrency class.
+        """
+        if name in _LIMITS:
+            _LIMITS[name].resize(size)
+        else:
+            _LIMITS[name] = _Limit(size)
+
+    __slots__ = ("name", "results", "async", "backend", "concurrency", "messages", "parent",
+                 "verbose", "held", "stack", "retain", "timeout", "deadline", "on_done",
+                 "context", "context_colors", "color", "fields", "_default_name")
+
+    STACK = STACK_LAZY
+    RETAIN = RETAIN_ALL
+
+    def __init__(self, name = None, async=False, stack=None, backend="green", concurrency=None,
+                 retain=None, timeout=None, on_done=None):
         self.name = name
         self.results = []
         self.async = async
+        self.backend = BACKENDS[backend]
+        self.concurrency = concurrency
+        self.on_done = on_done
         self.messages = []
 
         self.parent = self.current()
 
         if self.parent is None:
             self.verbose = False
+            self.held = frozenset()
+            self.fields = {}
         else:
             self.verbose = self.parent.verbose
+            # extra structured logging fields, these are replaced
+            # rather than modified so they can be shared
+            self.fields = self.parent.fields
+            # the concurrency classes held by our callers, nested
+            # invocations of the same class must not count against the
+            # limit or they will deadlock
+            self.held = self.parent.held
+            if self.parent.concurrency is not None:
+                self.held = self.held | frozenset((self.parent.concurrency,))
+
+        if stack is not None:
+            self.stack = stack
+        elif self.parent is None:
+            self.stack = self.STACK
+        else:
+            self.stack = self.parent.stack
+
+        if self.parent is None:
+            self.timeout = None
+            self.deadline = None
+        else:
+            self.timeout = self.parent.timeout
+            self.deadline = self.parent.deadline
+        if timeout is not None:
+            deadline = time.time() + timeout
+            if self.deadline is None or deadline < self.deadline:
+                self.timeout = timeout
+                self.deadline = deadline
+
+        if retain is not None:
+            self.retain = retain
+        elif self.parent is None:
+            self.retain = self.RETAIN
+        else:
+            self.retain = self.parent.retain
 
         if self.name is None:
             if self.parent:
@@ -369,15 +869,71 @@ class executor(object):
             self.context_colors = {}
         self.color = self.allocate_color(self.context)
 
+    @classmethod
+    @contextmanager
+    def _released_slot(cls, release=True):
+        """
+        Give back the pool slot held by the current greenthread for the
+        duration of the block. A task blocked waiting on other tasks
+        isn't doing any work, and if it holds on to its slot then the
+        very tasks it is waiting for can end up queued behind it.
+
+        Getting the slot back means queueing behind whatever took it,
+        so a task that is merely finishing up keeps its slot by passing
+        release=False.
+
+        Lent slots are counted in LENT so that the pool never looks
+        idle while a waiting task is still outstanding.
+        """
+        if release and getattr(cls.CURRENT, "pooled", False):
+            cls.CURRENT.pooled = False
+            executor.LENT += 1
+            _POOL.sem.release()
+            try:
+                yield
+            finally:
+                _POOL.sem.acquire()
+                executor.LENT -= 1
+                cls.CURRENT.pooled = True
+        else:
+            yield
+
+    def _pooled_run(self, result, fun, args, kwargs):
+        self.CURRENT.pooled = True
+        self.do_run(result, fun, args, kwargs)
+
     @contextmanager
     def _make_current(self, result):
         saved_executor = self.current()
         saved_result = self.current_result()
         self.CURRENT.executor = self
         self.CURRENT.result = result
-        yield
-        self.CURRENT.executor = saved_executor
-        self.CURRENT.result = saved_result
+        if self.TRACK:
+            glet = greenlet.getcurrent()
+            self.RUNNING[glet] = self
+        else:
+            glet = None
+        try:
+            yield
+        finally:
+            self.CURRENT.executor = saved_executor
+            self.CURRENT.result = saved_result
+            if glet is not None:
+                if saved_executor is None:
+                    self.RUNNING.pop(glet, None)
+                else:
+                    self.RUNNING[glet] = saved_executor
+
+    @contextmanager
+    def _deadline(self):
+        if self.deadline is None:
+            yield
+        else:
+            remaining = self.deadline - time.time()
+            if remaining <= 0:
+                raise TaskTimeout(self.timeout)
+            with eventlet.Timeout(remaining, TaskTimeout(self.timeout)):
+                yield
 
     def echo(self, text=u"", prefix=u"\u2551 ", newline=True):
         with self._make_current(None):
@@ -403,26 +959,76 @@ class executor(object):
         else:
             self.messages.append(text)
 
+    def _limiter(self):
+        if self.concurrency is None or self.concurrency in self.held:
+            return None
+        else:
+            return _LIMITS.get(self.concurrency)
+
     def do_run(self, result, fun, args, kwargs):
-        with self._make_current(result):
-            try:
-                result.value = fun(*args, **kwargs)
-            except:
-                result.value = ERROR
-                result.exception = sys.exc_info()
-            result.thread = None
-            result.wait()
+        limiter = self._limiter()
+        acquired = False
+        try:
+            with self._make_current(result):
+                try:
+                    # we can be cancelled while waiting for our
+                    # concurrency class, so this needs to be inside
+                    if limiter is not None:
+                        limiter.sem.acquire()
+                        acquired = True
+                    result.started = time.time()
+                    with self._deadline():
+                        result.value = self.backend.call(fun, args, kwargs)
+                except:
+                    result.value = ERROR
+                    result.exception = sys.exc_info()
+                result.thread = None
+                try:
+                    # our children are already running or queued, so
+                    # holding on to our slot can't starve them
+                    result._wait(False)
+                finally:
+                    result._finish()
+                if self.on_done is not None:
+                    self.on_done(result)
+                if self.retain == RETAIN_ERRORS:
+                    result._compact()
+        finally:
+            if acquired:
+                limiter.sem.release()
 
     def run(self, fun, *args, **kwargs):
-        result = Result(self, self.current_result())
-        result._capture_stack()
+        parent = self.current_result()
+        if parent is not None and parent._cancelled is not None:
+            raise parent._cancelled
+        if self.deadline is not None and time.time() >= self.deadline:
+            raise TaskTimeout(self.timeout)
+        result = Result(self, parent)
+        result.name = getattr(fun, "__name__", None)
+        result._capture_stack(self.stack)
         self.results.append(result)
         if self.async:
-            result.thread = _POOL.spawn(self.do_run, result, fun, args, kwargs)
+            if self._limiter() is None:
+                result.thread = _POOL.spawn(self._pooled_run, result, fun, args, kwargs)
+            else:
+                # invocations in a limited concurrency class are bounded
+                # by their own semaphore and don't occupy a pool slot
+                result.thread = eventlet.spawn(self.do_run, result, fun, args, kwargs)
         else:
             self.do_run(result, fun, args, kwargs)
         return result
 
+    def finished(self, value):
+        """
+        Return a result that is already finished with the given value
+        without running anything, e.g. for a value remembered from an
+        earlier invocation. It is not part of the caller's tree.
+        """
+        result = Result(self, None)
+        result.value = value
+        result.started = result.finished = time.time()
+        return result
+
     def wait(self):
         for r in self.results:
             r.wait()
@@ -13,7 +13,10 @@
 # limitations under the License.
 
 import fnmatch, os, re, requests
-from .tasks import sh, get, project, Elidable, Secret, TaskError
+from .tasks import sh, get, project, task, Elidable, Secret, TaskCache, TaskError
+
+"""How many repo lookups Github.list keeps in flight at once."""
+WINDOW = 16
 
 def next_page(response):
     if "Link" in response.headers:
@@ -57,12 +60,13 @@ class Github(object):
         sh("git", "pull", inject_token(url, self.token), cwd=directory)
 
     def list(self, organization, filter="*"):
-        repos = []
-        for response in self.paginate("orgs/%s/repos" % organization):
-            repos.extend(response.json())
-        filtered = [r for r in repos if fnmatch.fnmatch(r["full_name"], filter)]
-
-        real_repos = project(lambda x: self.get(x).json(), ["repos/%s" % r["full_name"] for r in filtered])
+        # fetch the details of each repo while we are still paging
+        # through the rest of the organization
+        names = ("repos/%s" % r["full_name"]
+                 for response in self.paginate("orgs/%s/repos" % organization)
+                 for r in response.json()
+                 if fnmatch.fnmatch(r["full_name"], filter))
+        real_repos = project(lambda x: self.get(x).json(), names, window=WINDOW)
         urls = [(r["full_name"], r["clone_url"]) for r in real_repos if "id" in r]
         return urls
 
@@ -76,6 +80,8 @@ class Github(object):
         else:
             raise TaskError(result)
 
+    # the origin doesn't depend on which Github instance is asking
+    @task(cache=TaskCache(key=lambda gh, directory: directory))
     def remote(self, directory):
         result = sh("git", "remote", "get-url", "origin", cwd=directory, expected=xrange(256))
         if result.code == 0:
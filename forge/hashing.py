@@ -0,0 +1,102 @@
+# Copyright 2017 datawire. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Content hashing for service versions. Each file is hashed on its own,
+a batch of files at a time on the thread pool, and the digests are
+combined in the order the files are listed, so the result doesn't
+depend on how the work was spread out.
+
+File digests are remembered in .forge/hash-cache.json next to the
+files, keyed by the size, mtime and inode of each file much like the
+git index, so a file that hasn't changed costs a stat.
+"""
+
+import errno, hashlib, itertools, mmap, os
+from . import offload
+from .statcache import StatCache
+from .tasks import task
+
+"""Files at least this big are hashed through mmap rather than read."""
+MMAP_SIZE = 16*offload.CHUNK_SIZE
+
+# files are hashed BATCH at a time, on up to WORKERS pool threads
+WORKERS = 8
+BATCH = 64
+
+def hash_file(path):
+    """
+    Return the sha1 of the contents of a file, reading it a chunk at
+    a time.
+    """
+    result = hashlib.sha1()
+    with open(path, "rb") as fd:
+        size = os.fstat(fd.fileno()).st_size
+        if size >= MMAP_SIZE:
+            m = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                for offset in xrange(0, size, offload.CHUNK_SIZE):
+                    result.update(buffer(m, offset, offload.CHUNK_SIZE))
+            finally:
+                m.close()
+        else:
+            for chunk in offload.chunks(fd):
+                result.update(chunk)
+    return result.hexdigest()
+
+class DigestCache(StatCache):
+
+    """
+    File digests by path relative to root. Lookups happen on pool
+    threads.
+    """
+
+    NAME = "hash-cache.json"
+    VERSION = 2
+
+    def __init__(self, root):
+        StatCache.__init__(self, root)
+        self.root = root
+
+    def digest(self, name):
+        """
+        Return the digest of a file, or None if it doesn't exist.
+        """
+        path = os.path.join(self.root, name)
+        try:
+            stamp = self.stamp(os.stat(path))
+            entry = self.old.get(name)
+            if entry and self.fresh(stamp, entry[0]):
+                digest = str(entry[1])
+            else:
+                digest = hash_file(path)
+        except (IOError, OSError), e:
+            if e.errno == errno.ENOENT:
+                return None
+            raise
+        if stamp is not None:
+            self.new[name] = [stamp, digest]
+        return digest
+
+@task()
+def shafiles(root, files):
+    cache = DigestCache(root)
+    batches = [files[i:i+BATCH] for i in range(0, len(files), BATCH)]
+    digests = offload.imap(lambda batch: [cache.digest(n) for n in batch], batches, WORKERS)
+    result = hashlib.sha1()
+    result.update("files %s\0" % len(files))
+    for name, digest in zip(files, itertools.chain(*digests)):
+        result.update("file %s\0%s\0" % (name, digest or ""))
+    cache.save()
+    return result.hexdigest()
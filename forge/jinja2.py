@@ -14,10 +14,11 @@
 
 from __future__ import absolute_import
 
+from . import offload
 from .sops import decrypt, decrypt_cleanup
 from .tasks import task, TaskError
 from jinja2 import Environment, FileSystemLoader, Template, TemplateError, TemplateNotFound, Undefined, UndefinedError
-import os, shutil
+import os
 
 
 class WarnUndefined(Undefined):
@@ -94,10 +95,10 @@ def render(source, target, predicate, **variables):
                       undefined=WarnUndefined)
     if os.path.isdir(source):
         if os.path.exists(target):
-            shutil.rmtree(target)
-        os.makedirs(target)
+            offload.rmtree(target)
+        offload.makedirs(target)
 
-        for path, dirs, files in os.walk(source):
+        for path, dirs, files in offload.walk(source):
             for name in files:
                 if not predicate(name): continue
                 if name.endswith("-enc.yaml"):
@@ -107,17 +108,15 @@ def render(source, target, predicate, **variables):
                 outfile = os.path.join(target, relpath)
                 outdir = os.path.dirname(outfile)
                 if not os.path.exists(outdir):
-                    os.makedirs(outdir)
-                with open(outfile, "write") as f:
-                    f.write(rendered)
+                    offload.makedirs(outdir)
+                offload.write(outfile, rendered.encode("utf-8"))
                 if name.endswith("-enc.yaml"):
                     decrypt_cleanup(path, name)
     else:
         if source.endswith("-enc.yaml"):
             decrypt(path, source)
         rendered = _do_render(env, root, os.path.basename(source), variables)
-        with open(target, "write") as f:
-            f.write(rendered)
+        offload.write(target, rendered.encode("utf-8"))
         if source.endswith("-enc.yaml"):
             decrypt_cleanup(path, source)
 
@@ -16,7 +16,7 @@ import os, glob
 from tasks import task, TaskError, get, sh, SHResult
 from forge.match import match
 from forge.yamlutil import MappingNode, Node, as_node, compose, compose_all, serialize_all, view
-from forge import yamlutil
+from forge import offload, yamlutil
 
 @match(MappingNode, basestring, dict)
 def fixup(node, key, pairs):
@@ -103,7 +103,7 @@ def status_summary(kind, status):
 def status_summary(kind, status):
     return str(status)
 
-def is_yaml_empty(dir):
+def _is_yaml_empty(dir):
     for path, dirs, files in os.walk(dir):
         for name in files:
             if is_yaml_file(name):
@@ -112,12 +112,34 @@ def is_yaml_empty(dir):
                         return False
     return True
 
+def is_yaml_empty(dir):
+    return offload.call(_is_yaml_empty, dir)
+
 def selector(labels):
     return "-l%s" % (",".join(("%s=%s" % (k, v)) if v else k for k, v in labels.items()))
 
 def is_yaml_file(name):
     return name.endswith(".yml") or name.endswith(".yaml")
 
+# manifests are small, so this runs on a pool thread to keep the file
+# I/O off the hub rather than paying for a worker process
+@task(backend="thread")
+def _labeltate_file(filename, key, labels):
+    fixed = []
+    with open(filename, 'r') as f:
+        for nd in compose_all(f):
+            fixup(nd, key, labels)
+            # we filter out null nodes because istioctl sticks
+            # them in for some reason, and then we end up
+            # serializing them in a way that kubectl doesn't
+            # understand
+            if nd.tag == u'tag:yaml.org,2002:null':
+                continue
+            fixed.append(nd)
+    munged = serialize_all(fixed)
+    with open(filename, 'w') as f:
+        f.write(munged)
+
 class Kubernetes(object):
 
     def __init__(self, namespace=None, context=None, dry_run=False):
@@ -125,7 +147,7 @@ class Kubernetes(object):
         self.context = context
         self.dry_run = dry_run
 
-    @task()
+    @task(concurrency="kubectl")
     def resources(self, yaml_dir):
         if is_yaml_empty(yaml_dir):
             return []
@@ -139,24 +161,11 @@ class Kubernetes(object):
             return SHResult("", 0, "")
         key = "annotations" if annotate else "labels"
 
-        for path, dirs, files in os.walk(yaml_dir):
+        for path, dirs, files in offload.walk(yaml_dir):
             for name in files:
                 if not is_yaml_file(name): continue
-                fixed = []
-                filename = os.path.join(path, name)
-                with open(filename, 'read') as f:
-                    for nd in compose_all(f):
-                        fixup(nd, key, labels)
-                        # we filter out null nodes because istioctl sticks
-                        # them in for some reason, and then we end up
-                        # serializing them in a way that kubectl doesn't
-                        # understand
-                        if nd.tag == u'tag:yaml.org,2002:null':
-                            continue
-                        fixed.append(nd)
-                munged = serialize_all(fixed)
-                with open(filename, 'write') as f:
-                    f.write(munged)
+                _labeltate_file.go(os.path.join(path, name), key, labels)
+        task.sync()
 
     @task()
     def annotate(self, yaml_dir, labels):
@@ -166,7 +175,7 @@ class Kubernetes(object):
     def label(self, yaml_dir, labels):
         self._labeltate(yaml_dir, labels, annotate=False)
 
-    @task()
+    @task(concurrency="kubectl")
     def apply(self, yaml_dir, prune=None):
         if is_yaml_empty(yaml_dir):
             return SHResult("", 0, "")
@@ -180,7 +189,7 @@ class Kubernetes(object):
         result = sh(*cmd)
         return result
 
-    @task()
+    @task(concurrency="kubectl")
     def list(self):
         """
         Return a structured view of all forge deployed resources in a kubernetes cluster.
@@ -243,7 +252,7 @@ class Kubernetes(object):
 
         return repos
 
-    @task()
+    @task(concurrency="kubectl")
     def delete(self, labels):
         # never try to delete namespaces or storage classes because they are shared resources
         all = ",".join(r for r in ALL if r not in ('ns', 'sc'))
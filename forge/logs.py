@@ -0,0 +1,182 @@
+# Copyright 2017 datawire. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+JSON lines logging for the task system. Log records are formatted
+where they are logged, so they carry the context of the task that
+logged them, and are then handed off to a single writer greenthread.
+The writer does the actual file I/O on a real thread so that logging
+never stalls the hub, and rotates the file once it gets too big.
+"""
+
+import datetime, eventlet, json, logging, os
+from collections import OrderedDict, deque
+from eventlet import tpool
+
+_thread = eventlet.patcher.original('thread')
+
+"""Rotate the log file once it would grow beyond this many bytes."""
+MAX_BYTES = 10*1024*1024
+
+"""How many rotated log files to keep around."""
+BACKUPS = 3
+
+class JSONFormatter(logging.Formatter):
+
+    """
+    Formats a record as a single line of JSON. The task context that
+    TaskFilter attaches to a record is included when present.
+    """
+
+    def format(self, record):
+        entry = OrderedDict()
+        entry["time"] = _timestamp(record.created)
+        entry["level"] = record.levelname
+        entry["logger"] = record.name
+        entry["message"] = record.getMessage()
+        for attr in "task_id", "task", "context":
+            value = getattr(record, attr, None)
+            if value is not None:
+                entry[attr] = value
+        started = getattr(record, "task_started", None)
+        if started is not None:
+            entry["task_started"] = _timestamp(started)
+        for k, v in sorted(getattr(record, "fields", {}).items()):
+            entry.setdefault(k, v)
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=repr)
+
+def _timestamp(seconds):
+    return datetime.datetime.utcfromtimestamp(seconds).isoformat() + "Z"
+
+class _RotatingFile(object):
+
+    """
+    An append only file that is rotated by size the same way
+    logging.handlers.RotatingFileHandler does it, i.e. path.1 is the
+    most recent backup. This is only ever written from one thread at
+    a time, the lock is for the final flush at exit.
+    """
+
+    def __init__(self, path, max_bytes, backups):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.fd = None
+        self.size = 0
+        self.lock = _thread.allocate_lock()
+
+    def write(self, data):
+        with self.lock:
+            if self.fd is None:
+                self.fd = open(self.path, "a")
+                self.size = os.fstat(self.fd.fileno()).st_size
+            if self.max_bytes and self.size and self.size + len(data) > self.max_bytes:
+                self._rotate()
+            self.fd.write(data)
+            self.fd.flush()
+            self.size += len(data)
+
+    def _rotate(self):
+        self.fd.close()
+        if self.backups > 0:
+            for i in range(self.backups - 1, 0, -1):
+                src = "%s.%d" % (self.path, i)
+                if os.path.exists(src):
+                    os.rename(src, "%s.%d" % (self.path, i + 1))
+            os.rename(self.path, "%s.1" % self.path)
+            self.fd = open(self.path, "a")
+        else:
+            self.fd = open(self.path, "w")
+        self.size = 0
+
+    def close(self):
+        with self.lock:
+            if self.fd is not None:
+                self.fd.close()
+                self.fd = None
+
+class AsyncHandler(logging.Handler):
+
+    """
+    A logging handler that queues formatted records for a writer
+    greenthread rather than writing them out itself. The writer wakes
+    up every *interval* seconds and writes whatever has queued up in a
+    single call on a real thread. If more than *max_pending* records
+    queue up, further records are dropped and counted rather than
+    slowing down the code doing the logging. Records from threads
+    other than the one running the hub are picked up on the next
+    round.
+    """
+
+    INTERVAL = 0.1
+    MAX_PENDING = 10000
+
+    def __init__(self, path, max_bytes=MAX_BYTES, backups=BACKUPS, interval=INTERVAL,
+                 max_pending=MAX_PENDING):
+        logging.Handler.__init__(self)
+        self.setFormatter(JSONFormatter())
+        self.file = _RotatingFile(path, max_bytes, backups)
+        self.interval = interval
+        self.max_pending = max_pending
+        self.pending = deque()
+        self.dropped = 0
+        self.writer = None
+        self.thread = _thread.get_ident()
+
+    def emit(self, record):
+        try:
+            line = self.format(record) + "\n"
+        except Exception:
+            self.handleError(record)
+            return
+        if len(self.pending) >= self.max_pending:
+            self.dropped += 1
+            return
+        self.pending.append(line)
+        if self.writer is None and _thread.get_ident() == self.thread:
+            self.writer = eventlet.spawn(self._write_loop)
+
+    def _write_loop(self):
+        try:
+            while self.pending:
+                eventlet.sleep(self.interval)
+                self._drain(True)
+        finally:
+            self.writer = None
+
+    def _drain(self, offload):
+        lines = []
+        while self.pending:
+            lines.append(self.pending.popleft())
+        if self.dropped:
+            record = logging.makeLogRecord({"name": "forge.logs", "levelno": logging.WARNING,
+                                            "levelname": "WARNING",
+                                            "msg": "dropped %d log records" % self.dropped})
+            lines.append(self.format(record) + "\n")
+            self.dropped = 0
+        if lines:
+            if offload:
+                tpool.execute(self.file.write, "".join(lines))
+            else:
+                self.file.write("".join(lines))
+
+    def flush(self):
+        self._drain(False)
+
+    def close(self):
+        self.flush()
+        self.file.close()
+        logging.Handler.close(self)
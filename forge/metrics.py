@@ -0,0 +1,134 @@
+# Copyright 2017 datawire. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+A registry of per task invocation counts, error counts, and latency
+histograms. The registry can be rendered in the Prometheus text
+exposition format or as JSON.
+"""
+
+import bisect, json
+
+"""The default histogram bucket upper bounds in seconds."""
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+class Histogram(object):
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        # the last count is for observations beyond the largest bucket
+        self.counts = [0]*(len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        """
+        Yield (upper bound, count) pairs the way Prometheus expects
+        them, i.e. each count includes all the buckets below it.
+        """
+        total = 0
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            total += count
+            yield bound, total
+
+    def json(self):
+        return {"buckets": [[_bound(b), c] for b, c in self.cumulative()],
+                "sum": self.sum,
+                "count": self.count}
+
+class TaskMetrics(object):
+
+    def __init__(self, buckets=BUCKETS):
+        self.invocations = 0
+        self.errors = 0
+        self.duration = Histogram(buckets)
+
+class Registry(object):
+
+    """
+    Collects metrics for every task by name. A task that never got to
+    run, e.g. because it was cancelled first, counts as an invocation
+    but has no duration.
+    """
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.tasks = {}
+
+    def observe(self, name, duration, error):
+        metrics = self.tasks.get(name)
+        if metrics is None:
+            metrics = TaskMetrics(self.buckets)
+            self.tasks[name] = metrics
+        metrics.invocations += 1
+        if error:
+            metrics.errors += 1
+        if duration is not None:
+            metrics.duration.observe(duration)
+
+    def clear(self):
+        self.tasks.clear()
+
+    def prometheus(self):
+        names = sorted(self.tasks)
+        lines = ["# HELP forge_task_invocations_total Number of times each task was invoked.",
+                 "# TYPE forge_task_invocations_total counter"]
+        for n in names:
+            lines.append('forge_task_invocations_total{task="%s"} %d' % (_escape(n), self.tasks[n].invocations))
+        lines.extend(["# HELP forge_task_errors_total Number of task invocations that errored.",
+                      "# TYPE forge_task_errors_total counter"])
+        for n in names:
+            lines.append('forge_task_errors_total{task="%s"} %d' % (_escape(n), self.tasks[n].errors))
+        lines.extend(["# HELP forge_task_duration_seconds How long each task invocation took.",
+                      "# TYPE forge_task_duration_seconds histogram"])
+        for n in names:
+            label = _escape(n)
+            hist = self.tasks[n].duration
+            for bound, count in hist.cumulative():
+                lines.append('forge_task_duration_seconds_bucket{task="%s",le="%s"} %d' %
+                             (label, _bound(bound), count))
+            lines.append('forge_task_duration_seconds_sum{task="%s"} %r' % (label, hist.sum))
+            lines.append('forge_task_duration_seconds_count{task="%s"} %d' % (label, hist.count))
+        return "\n".join(lines) + "\n"
+
+    def json(self):
+        result = {}
+        for n, m in self.tasks.items():
+            result[n] = {"invocations": m.invocations,
+                         "errors": m.errors,
+                         "duration": m.duration.json()}
+        return result
+
+    def write(self, path):
+        """
+        Write the metrics to *path*, as JSON if the path ends with
+        .json and in the Prometheus text format otherwise.
+        """
+        with open(path, "w") as fd:
+            if path.endswith(".json"):
+                json.dump(self.json(), fd, indent=2, sort_keys=True)
+                fd.write("\n")
+            else:
+                fd.write(self.prometheus())
+
+def _bound(bound):
+    return "+Inf" if bound == float("inf") else repr(bound)
+
+def _escape(label):
+    return label.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
@@ -0,0 +1,97 @@
+# Copyright 2017 datawire. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Green-safe file system access. Eventlet can't make disk I/O
+cooperative, so a large read or a walk of a big tree blocks every
+other greenthread until it is done. The helpers here run the
+blocking part on a real thread from the eventlet thread pool instead,
+and are safe to call from code that is already on that pool.
+
+Only the file system work belongs in here: code running on a pool
+thread is outside of the executor and must not use tasks.
+"""
+
+import eventlet, os, shutil, tempfile
+from eventlet import tpool
+
+"""How much is read at a time when streaming a file."""
+CHUNK_SIZE = 1024*1024
+
+def call(fun, *args, **kwargs):
+    """
+    Run a blocking function on the thread pool and return its result.
+    """
+    return tpool.execute(fun, *args, **kwargs)
+
+def imap(fun, seq, workers):
+    """
+    Apply a blocking function to each item of seq on the thread pool,
+    with at most workers of them running at once, and yield the
+    results in order.
+    """
+    return eventlet.GreenPool(workers).imap(lambda item: call(fun, item), seq)
+
+def _read(path, mode):
+    with open(path, mode) as fd:
+        return fd.read()
+
+def read(path, mode="rb"):
+    return call(_read, path, mode)
+
+def _write(path, data, mode):
+    with open(path, mode) as fd:
+        fd.write(data)
+
+def write(path, data, mode="wb"):
+    call(_write, path, data, mode)
+
+def walk(top):
+    """
+    Like os.walk, but the whole tree is listed in one go on the thread
+    pool, so the result is a list.
+    """
+    return call(lambda: list(os.walk(top)))
+
+def _replace(path, data):
+    directory = os.path.dirname(path)
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix="." + os.path.basename(path))
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.rename(tmp, path)
+    except:
+        os.unlink(tmp)
+        raise
+
+def replace(path, data):
+    """
+    Write data to path atomically, by way of a temporary file that is
+    renamed into place, creating the directory if need be.
+    """
+    call(_replace, path, data)
+
+def makedirs(path):
+    call(os.makedirs, path)
+
+def rmtree(path):
+    call(shutil.rmtree, path)
+
+def chunks(fd, size=CHUNK_SIZE):
+    """
+    Yield the contents of an open file a chunk at a time.
+    """
+    return iter(lambda: fd.read(size), "")
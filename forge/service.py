@@ -12,14 +12,16 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import copy, errno, fnmatch, hashlib, jsonschema, os, pathspec, util, yaml
+import copy, errno, fnmatch, hashlib, itertools, json, jsonschema, os, pathspec, tempfile, util, yaml
 from collections import OrderedDict
-from forge import service_info
+from forge import offload, service_info
 from .jinja2 import render, renders
 from .kubernetes import is_yaml_file
 from .schema import SchemaError
-from .tasks import sh, task, TaskError
+from .tasks import project, sh, task, TaskError
 from .github import Github
+from .hashing import shafiles
+from .statcache import StatCache
 from forge import yamlutil
 
 def load_service_yaml(path, **vars):
@@ -47,16 +49,71 @@ def load_service_yamls(name, content, **vars):
     except yaml.scanner.ScannerError, e:
         _dump_and_raise(rendered, e)
 
+IGNORE_FILES = (".gitignore", ".forgeignore")
+
+def _read_ignores(path):
+    with open(path) as fd:
+        return fd.readlines()
+
 def get_ignores(directory):
-    ignorefiles = [os.path.join(directory, ".gitignore"),
-                   os.path.join(directory, ".forgeignore")]
     ignores = []
-    for path in ignorefiles:
+    for name in IGNORE_FILES:
+        path = os.path.join(directory, name)
         if os.path.exists(path):
-            with open(path) as fd:
-                ignores.extend(fd.readlines())
+            ignores.extend(_read_ignores(path))
     return ignores
 
+class _Ignores(object):
+
+    """
+    The ignore patterns in effect for a directory, as a chain of
+    layers, one per directory that has ignore files of its own. Each
+    layer is compiled once and shared by everything beneath it.
+
+    As with a single PathSpec built from all the lines in order, the
+    last pattern to match a path decides whether it is ignored, so the
+    innermost layer gets the first say. Paths are relative to the
+    directory being searched.
+    """
+
+    def __init__(self, lines, parent=None):
+        spec = pathspec.PathSpec.from_lines('gitwildmatch', lines)
+        self.patterns = [p for p in reversed(spec.patterns) if p.include is not None]
+        self.parent = parent
+
+    def layer(self, lines):
+        return _Ignores(lines, self) if lines else self
+
+    def match(self, path):
+        layer = self
+        while layer is not None:
+            for p in layer.patterns:
+                if p.regex.match(path):
+                    return p.include
+            layer = layer.parent
+        return False
+
+class _Entry(object):
+
+    """
+    A stand in for scandir.DirEntry when scandir isn't available.
+    """
+
+    __slots__ = ("name", "path")
+
+    def __init__(self, directory, name):
+        self.name = name
+        self.path = os.path.join(directory, name)
+
+    def is_dir(self):
+        return os.path.isdir(self.path)
+
+try:
+    from scandir import scandir as _scandir
+except ImportError:
+    def _scandir(directory):
+        return [_Entry(directory, n) for n in os.listdir(directory)]
+
 def get_ancestors(path, stop="/"):
     path = os.path.abspath(path)
     stop = os.path.abspath(stop)
@@ -72,19 +129,128 @@ def get_search_path(forge, svc):
     for p in svc.search_path:
         yield os.path.join(forge.base, p)
 
-def is_service_descriptor(path):
+K8S_KEYS = frozenset(("apiVersion", "kind", "metadata"))
+
+def is_service_descriptor(path, content=None):
+    """
+    Tell a service.yaml apart from a kubernetes manifest that happens
+    to be called service.yaml, by looking no further than the top
+    level keys of its first document.
+    """
+    if content is None:
+        content = offload.read(path)
+    seen = set()
     try:
-        objs = yamlutil.load(path)
+        for key in yamlutil.top_level_keys(content):
+            if key in K8S_KEYS:
+                seen.add(key)
+                if seen == K8S_KEYS:
+                    return False
     except yaml.parser.ParserError, e:
         return True
     except yaml.scanner.ScannerError, e:
         return True
-    if objs:
-        first = objs[0]
-        if "apiVersion" in first and "kind" in first and "metadata" in first:
-            return False
     return True
 
+def _digest(parent, lines):
+    return hashlib.sha1(parent + json.dumps(lines)).hexdigest()
+
+def _utf8(obj):
+    if isinstance(obj, unicode):
+        return obj.encode("utf-8")
+    elif isinstance(obj, list):
+        return [_utf8(o) for o in obj]
+    else:
+        return obj
+
+# directory listings are stored as a single string, with a trailing
+# slash marking directories, to keep the index quick to load
+def _pack(entries):
+    return "\0".join(n + "/" if is_dir else n for n, is_dir in entries)
+
+def _unpack(packed):
+    if not packed:
+        return []
+    return [(n[:-1], True) if n[-1] == "/" else (n, False)
+            for n in _utf8(packed).split("\0")]
+
+class _Index(StatCache):
+
+    """
+    What Discovery.search found in each directory the last time it
+    searched a tree: the directory listing, the ignore patterns in
+    effect, the entries that survived them, and whether service.yaml
+    files are service descriptors, kept in
+    .forge/discovery-index.json.
+
+    Listings are keyed by the mtime of their directory, which changes
+    whenever an entry is added, removed or renamed, so every directory
+    is still visited, but with a stat instead of a listing, and
+    without reading ignore files, matching patterns, or parsing yaml.
+    """
+
+    NAME = "discovery-index.json"
+    VERSION = 2
+
+    def scan(self, directories):
+        """
+        Stat each of a batch of (path, rel) directories and list it
+        unless the index still has its listing, and pick up the lines
+        of its ignore files. This runs on the thread pool, so it
+        returns None for a directory that has gone away rather than
+        touching anything shared.
+        """
+        return [self._scan(path, rel) for path, rel in directories]
+
+    def _scan(self, path, rel):
+        try:
+            st = os.stat(path)
+        except OSError, e:
+            if e.errno == errno.ENOENT:
+                return None
+            raise
+        old = self.old.get(rel, {})
+        rec = {"stamp": self.stamp(st)}
+        listed = not self.fresh(rec["stamp"], old.get("stamp"))
+        if listed:
+            entries = [(e.name, e.is_dir()) for e in _scandir(path)]
+            rec["entries"] = _pack(entries)
+        else:
+            rec["entries"] = old["entries"]
+            entries = _unpack(rec["entries"])
+        names = set(n for n, _ in entries)
+
+        lines = []
+        rec["ignores"] = {}
+        for name in IGNORE_FILES:
+            if name in names:
+                lines.extend(self.cached(rec, old, "ignores", name, os.path.join(path, name), _read_ignores))
+        return rec, entries, lines, listed
+
+    def cached(self, rec, old, kind, name, path, compute):
+        """
+        Look up what was derived from the file at path last time, or
+        derive it afresh with compute, and record it in rec.
+        """
+        stamp = self.stamp(os.stat(path))
+        previous = old.get(kind, {}).get(name)
+        if previous and self.fresh(stamp, previous[0]):
+            value = _utf8(previous[1])
+        else:
+            value = compute(path)
+        rec[kind][name] = [stamp, value]
+        return value
+
+def _ignored(ignores, rel, is_dir):
+    # ignored directories are pruned up front rather than having
+    # everything in them ignored one by one
+    return ignores.match(rel) or (is_dir and ignores.match(rel + "/"))
+
+"""How many threads list directories at once during discovery."""
+WALKERS = 8
+"""How many directories each of them lists in one go."""
+BATCH = 32
+
 class Discovery(object):
 
     def __init__(self, forge):
@@ -109,36 +275,72 @@ class Discovery(object):
         for d in get_ancestors(directory, gitroot):
             base_ignores.extend(get_ignores(d))
 
+        index = _Index(directory)
+
+        # list the tree a level at a time, with the directories of each
+        # level spread over the thread pool, and keep what survives the
+        # ignore patterns in each directory
+        kept = {}
+        level = [(directory, "", _Ignores(base_ignores), _digest("", base_ignores))]
+        while level:
+            batches = [level[i:i+BATCH] for i in range(0, len(level), BATCH)]
+            scans = offload.imap(index.scan, [[(p, r) for p, r, _, _ in b] for b in batches], WALKERS)
+            following = []
+            for (path, rel, ignores, digest), scan in zip(level, itertools.chain(*scans)):
+                if scan is None:
+                    continue
+                rec, entries, lines, listed = scan
+                index.new[rel] = rec
+                if lines:
+                    ignores = ignores.layer(lines)
+                    digest = _digest(digest, lines)
+                old = index.old.get(rel, {})
+                rec["digest"] = digest
+                if not listed and old.get("digest") == digest:
+                    rec["kept"] = old["kept"]
+                    kept[rel] = _unpack(rec["kept"])
+                else:
+                    kept[rel] = [(n, is_dir) for n, is_dir in entries
+                                 if not _ignored(ignores, rel + n, is_dir)]
+                    rec["kept"] = _pack(kept[rel])
+                for n, is_dir in kept[rel]:
+                    if is_dir:
+                        following.append((os.path.join(path, n), rel + n + "/", ignores, digest))
+            level = following
+
+        # then put together the services in the same order a depth
+        # first walk finds them, file order feeds into versions
         found = []
-        def descend(path, parent, ignores):
-            if not os.path.exists(path): return
-            ignores = ignores[:]
-
-            ignores += get_ignores(path)
-            spec = pathspec.PathSpec.from_lines('gitwildmatch', ignores)
-            names = [n for n in os.listdir(path) if not spec.match_file(os.path.relpath(os.path.join(path, n),
-                                                                                        directory))]
-
+        def descend(path, rel, parent, prel):
+            if rel not in kept:
+                return
+            names = [n for n, _ in kept[rel]]
             if "service.yaml" in names:
                 candidate = os.path.join(path, "service.yaml")
-                if is_service_descriptor(candidate):
-                    svc = Service(self.forge, candidate, shallow=shallow)
+                # read once, for both the sniff and the service
+                content = offload.read(candidate)
+                rec = index.new[rel]
+                rec["descriptor"] = {}
+                if index.cached(rec, index.old.get(rel, {}), "descriptor", "service.yaml", candidate,
+                                lambda p: is_service_descriptor(p, content)):
+                    svc = Service(self.forge, candidate, shallow=shallow, content=content)
                     if svc.name not in self.services:
                         self.services[svc.name] = svc
                     found.append(svc)
                     parent = svc
+                    prel = ""
 
             if "Dockerfile" in names and parent:
-                parent.dockerfiles.append(os.path.relpath(os.path.join(path, "Dockerfile"), parent.root))
+                parent.dockerfiles.append(prel + "Dockerfile")
 
-            for n in names:
-                child = os.path.join(path, n)
-                if os.path.isdir(child):
-                    descend(child, parent, ignores)
+            for n, is_dir in kept[rel]:
+                if is_dir:
+                    descend(os.path.join(path, n), rel + n + "/", parent, prel + n + "/")
                 elif parent:
-                    parent.files.append(os.path.relpath(child, parent.root))
+                    parent.files.append(prel + n)
 
-        descend(directory, None, base_ignores)
+        descend(directory, "", None, "")
+        index.save()
         return found
 
     def resolve(self, svc, dep):
@@ -147,22 +349,49 @@ class Discovery(object):
             if dep in [svc.name for svc in found]:
                 return True
 
-        gh = Github(None)
-        target = os.path.join(svc.forgeroot, ".forge", dep)
-        if not os.path.exists(target):
-            url = gh.remote(svc.root)
-            if url is None: return False
-            parts = url.split("/")
-            prefix = "/".join(parts[:-1])
-            remote = prefix + "/" + dep + ".git"
-            if gh.exists(remote):
-                task.echo("cloning %s->%s" % (remote, os.path.relpath(target, os.getcwd())))
-                gh.clone(remote, target)
-            else:
-                raise TaskError("cannot resolve dependency: %s" % dep)
+        target = self.checkout(svc, dep)
+        if target is None:
+            return False
         found = self.search(target, shallow=True)
         return dep in [svc.name for svc in found]
 
+    # services that share a missing dependency may try to check it out
+    # at the same time, only one of them gets to and the rest wait for
+    # it to finish before looking at the checkout
+    @task(singleflight=lambda self, svc, dep: _checkout_path(svc, dep))
+    def checkout(self, svc, dep):
+        """
+        Return the path of a checkout of dep next to svc, cloning it
+        from the same place as svc if there isn't one yet, or None if
+        svc didn't come from anywhere.
+        """
+        target = _checkout_path(svc, dep)
+        if os.path.exists(target):
+            return target
+        gh = Github(None)
+        url = gh.remote(svc.root)
+        if url is None:
+            return None
+        parts = url.split("/")
+        prefix = "/".join(parts[:-1])
+        remote = prefix + "/" + dep + ".git"
+        if not gh.exists(remote):
+            raise TaskError("cannot resolve dependency: %s" % dep)
+        task.echo("cloning %s->%s" % (remote, os.path.relpath(target, os.getcwd())))
+        # clone beside the target and move it into place, so the target
+        # never exists half populated
+        parent = os.path.dirname(target)
+        if not os.path.exists(parent):
+            os.makedirs(parent)
+        partial = tempfile.mkdtemp(prefix="." + dep, dir=parent)
+        try:
+            gh.clone(remote, partial)
+            os.rename(partial, target)
+        except:
+            offload.rmtree(partial)
+            raise
+        return target
+
     @task()
     def dependencies(self, targets):
         todo = [self.services[t] for t in targets]
@@ -171,36 +400,35 @@ class Discovery(object):
         added = []
         missing = []
         while todo:
-            svc = todo.pop()
-            if svc in visited:
-                continue
-            visited.add(svc)
-            for r in svc.requires:
-                if r not in self.services:
-                    if not self.resolve(root, r):
-                        if r not in missing: missing.append(r)
-                if r not in targets and r not in added:
-                    added.append(r)
-                if r in self.services:
-                    todo.append(self.services[r])
+            level = []
+            for svc in todo:
+                if svc not in visited:
+                    visited.add(svc)
+                    level.append(svc)
+            # resolve everything this level is missing at once
+            wanted = []
+            for svc in level:
+                for r in svc.requires:
+                    if r not in self.services and r not in wanted and r not in missing:
+                        wanted.append(r)
+            for r, resolved in zip(wanted, project(lambda r: self.resolve(root, r), wanted)):
+                if not resolved:
+                    missing.append(r)
+            todo = []
+            for svc in level:
+                for r in svc.requires:
+                    if r not in targets and r not in added:
+                        added.append(r)
+                    if r in self.services:
+                        todo.append(self.services[r])
 
         if missing:
             raise TaskError("required service(s) missing: %s" % ", ".join(missing))
         else:
             return added
 
-def shafiles(root, files):
-    result = hashlib.sha1()
-    result.update("files %s\0" % len(files))
-    for name in files:
-        result.update("file %s\0" % name)
-        try:
-            with open(os.path.join(root, name)) as fd:
-                result.update(fd.read())
-        except IOError, e:
-            if e.errno != errno.ENOENT:
-                raise
-    return result.hexdigest()
+def _checkout_path(svc, dep):
+    return os.path.join(svc.forgeroot, ".forge", dep)
 
 def is_git(path):
     if os.path.exists(os.path.join(path, ".git")):
@@ -210,6 +438,7 @@ def is_git(path):
     else:
         return False
 
+@task(concurrency="git", cache=True)
 def get_version(path, dirty):
     if is_git(path):
         result = sh("git", "diff", "--quiet", "HEAD", ".", cwd=path, expected=(0, 1))
@@ -220,13 +449,25 @@ def get_version(path, dirty):
                 return "%s.git" % version
     return dirty
 
+# What it takes to pick up a change to a service's files, cheapest
+# first. See Service.affected.
+MANIFESTS = "manifests"
+REBUILD = "rebuild"
+BUILD = "build"
+
+def _within(path, prefix):
+    prefix = os.path.normpath(prefix)
+    return prefix == "." or path == prefix or path.startswith(prefix + os.sep)
+
 class Service(object):
 
-    def __init__(self, forge, descriptor, shallow=False):
+    def __init__(self, forge, descriptor, shallow=False, content=None):
         self.forge = forge
         self.descriptor = descriptor
         self.dockerfiles = []
         self.files = []
+        # the raw descriptor if whoever found it has already read it
+        self._content = content
         self._info = None
         self._version = None
         self.shallow = shallow
@@ -283,7 +524,7 @@ class Service(object):
         return name
 
 
-    @task()
+    @task(concurrency="git")
     def pull(self, pulled):
         if self.is_git and self.shallow:
             if self.gitroot not in pulled:
@@ -367,9 +608,44 @@ class Service(object):
         metadata = self.metadata()
         render(self.manifest_dir, self.manifest_target_dir, is_yaml_file, **metadata)
 
+    def affected(self, paths):
+        """
+        Work out the least that needs redoing to pick up changes to
+        *paths*, which are relative to the service root and must all
+        be files the service already knows about. Returns one of
+        MANIFESTS, REBUILD, or BUILD, along with the changed sources of
+        every container for a REBUILD.
+
+        A rebuild is only possible when every container is a rebuild
+        container and every changed file is one of their sources,
+        anything else needs a full build.
+        """
+        k8s = os.path.relpath(self.manifest_dir, self.root)
+        rest = set(p for p in paths if not _within(p, k8s))
+        if not rest:
+            return MANIFESTS, ()
+        if os.path.relpath(self.descriptor, self.root) in rest:
+            return BUILD, ()
+        containers = list(self.containers)
+        if not all(c.rebuild for c in containers):
+            return BUILD, ()
+        plan = []
+        covered = set()
+        for c in containers:
+            changed = sorted(p for p in rest if any(_within(p, src) for src in c.rebuild_sources))
+            covered.update(changed)
+            plan.append((c, changed))
+        if covered != rest:
+            return BUILD, ()
+        return REBUILD, plan
+
     def info(self):
         if self._info is None:
-            self._info = load_service_yaml(self.descriptor, branch=self.branch)
+            if self._content is None:
+                self._info = load_service_yaml(self.descriptor, branch=self.branch)
+            else:
+                self._info = load_service_yamls(self.descriptor, self._content, branch=self.branch)
+                self._content = None
             v = self._info.get("istio", None)
             if v in (True, False):
                 self._info["istio"] = OrderedDict(enabled=v)
@@ -443,17 +719,27 @@ class Container(object):
         return self.rebuild_sources or self.rebuild_command
 
     @task()
-    def build(self):
+    def build(self, changed=None):
+        """
+        Build the image for this container. For a rebuild container,
+        *changed* is a list of source files that changed since the last
+        build, only those get copied into the builder, and the rebuild
+        command only runs if there are any.
+        """
         if self.rebuild:
             builder = self.service.docker.builder(self.abs_context, self.abs_dockerfile, self.image, self.version, self.args, builder=self.builder)
-            builder.run("mkdir", "-p", self.rebuild_root)
-            for src in self.rebuild_sources:
-                abs_src = os.path.join(self.service.root, src)
-                tgt_src = os.path.join(self.rebuild_root, src)
-                if os.path.isdir(abs_src):
-                    builder.run("rm", "-rf", tgt_src)
-                builder.cp(abs_src, tgt_src)
-            if self.rebuild_command:
+            if changed is None:
+                builder.run("mkdir", "-p", self.rebuild_root)
+                for src in self.rebuild_sources:
+                    abs_src = os.path.join(self.service.root, src)
+                    tgt_src = os.path.join(self.rebuild_root, src)
+                    if os.path.isdir(abs_src):
+                        builder.run("rm", "-rf", tgt_src)
+                    builder.cp(abs_src, tgt_src)
+            else:
+                for path in changed:
+                    builder.cp(os.path.join(self.service.root, path), os.path.join(self.rebuild_root, path))
+            if self.rebuild_command and changed != []:
                 builder.run("/bin/sh", "-c", self.rebuild_command)
             builder.commit(self.image, self.version)
         else:
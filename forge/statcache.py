@@ -0,0 +1,85 @@
+# Copyright 2017 datawire. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Persistent caches of things derived from the file system, such as
+directory listings or file digests. Each entry is stored along with a
+stamp of the stat of whatever it was derived from, and is only good
+for as long as that stamp is unchanged.
+
+A cache is loaded in full when it is created, collects the entries of
+the current run as they are used, and replaces the file with those
+in one go when saved, so entries for things that are gone drop out.
+"""
+
+import json, os, time
+from . import offload
+
+"""
+Anything modified less than this many seconds before it was looked at
+may be modified again without its mtime changing, so it isn't trusted.
+"""
+RACY = 1.0
+
+class StatCache(object):
+
+    """
+    A cache kept as json in a file under .forge. Subclasses set NAME
+    for the file name and bump VERSION when their entries change
+    shape.
+    """
+
+    NAME = None
+    VERSION = 1
+
+    def __init__(self, root):
+        self.path = os.path.join(root, ".forge", self.NAME)
+        self.started = time.time()
+        self.old = self.load()
+        self.new = {}
+
+    def load(self):
+        try:
+            data = json.loads(offload.read(self.path))
+        except (IOError, OSError, ValueError):
+            return {}
+        if not isinstance(data, dict) or data.get("version") != self.VERSION:
+            return {}
+        return dict((k.encode("utf-8"), v) for k, v in data["entries"].items())
+
+    def stamp(self, st):
+        """
+        Return the stamp for a stat result, or None if what it is for
+        was modified too recently to be trusted.
+        """
+        if st.st_mtime >= self.started - RACY:
+            return None
+        return [st.st_size, int(st.st_mtime*1e9), st.st_ino]
+
+    def fresh(self, stamp, previous):
+        """
+        Tell whether something stored with the previous stamp is still
+        good for the given one.
+        """
+        return stamp is not None and stamp == previous
+
+    def save(self):
+        if self.new == self.old:
+            return
+        try:
+            offload.replace(self.path, json.dumps({"version": self.VERSION, "entries": self.new}))
+        except (IOError, OSError):
+            # e.g. a read only checkout, the cache is only an
+            # optimization
+            pass
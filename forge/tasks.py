@@ -12,10 +12,13 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import eventlet, functools, sys, os
+import eventlet, eventlet.queue, functools, sys, os
+from collections import OrderedDict, deque
 from contextlib import contextmanager
 from eventlet.corolocal import local
 from eventlet.green import time
+from . import logs
+from .metrics import Registry
 from .sentinel import Sentinel
 
 logging = eventlet.import_patched('logging')
@@ -36,10 +39,11 @@ def setup(logfile=None):
         logfile = "/tmp/forge-{}-{}.log".format(os.environ.get("USER", os.getuid()),
                                                 datetime.date.today().isoformat())
 
-    logging.getLogger("tasks").addFilter(TaskFilter())
-    logging.basicConfig(filename=logfile,
-                        level=logging.INFO,
-                        format='%(levelname)s %(task_id)s: %(message)s')
+    handler = logs.AsyncHandler(logfile)
+    handler.addFilter(TaskFilter())
+    root = logging.getLogger()
+    root.addHandler(handler)
+    root.setLevel(logging.INFO)
     executor.setup()
     executor.resize(5)
 
@@ -56,10 +60,20 @@ class TaskError(Exception):
     pass
 
 ChildError = emod.ChildError
+TaskCancelled = emod.TaskCancelled
+TaskTimeout = emod.TaskTimeout
 
 PENDING = emod.PENDING
 ERROR = emod.ERROR
 
+RETAIN_ALL = emod.RETAIN_ALL
+RETAIN_ERRORS = emod.RETAIN_ERRORS
+
+_LOGGER = logging.getLogger("tasks")
+
+"""Invocation counts, error counts, and latencies for every task, keyed by function name."""
+METRICS = Registry()
+
 def elapsed(delta):
     """
     Return a pretty representation of an elapsed time.
@@ -71,19 +85,23 @@ def elapsed(delta):
 class TaskFilter(logging.Filter):
 
     """
-    This logging filter augments log records with useful context when
-    log statements are made within a task. It also captures the log
-    messages made within a task and records them in the execution
-    object for a task invocation.
-
+    This logging filter augments log records with the context of the
+    task invocation that logged them, if any: its id, name, executor
+    context, start time, and any fields set with task.fields.
     """
 
     def filter(self, record):
-        exe = execution.current()
-        if exe:
-            record.task_id = exe.id
+        exe = executor.current()
+        result = executor.current_result()
+        if result is not None:
+            record.task_id = result.seq
+            record.task = result.name
+            record.task_started = result.started
         else:
             record.task_id = "(none)"
+        if exe is not None:
+            record.context = exe.context
+            record.fields = exe.fields
         return True
 
 class task(object):
@@ -151,11 +169,87 @@ class task(object):
 
         normpath.run("/foo//bar/baz")
 
+    CPU bound tasks can ask to be run on a real thread or process
+    pool instead of a greenthread so that large fan-outs can make use
+    of more than one core::
+
+        @task(backend="process")
+        def digest(path):
+            ...
+
+    See the executor documentation for the restrictions this places
+    on the task.
+
+    Tasks that use a constrained resource can tag themselves with a
+    named concurrency class. The limit for each class is configured
+    with executor.limit, and invocations of a class with no configured
+    limit simply share the default pool::
+
+        @task(concurrency="docker_build")
+        def build(directory):
+            ...
+
+    A task can be given a timeout in seconds. The deadline applies to
+    the task and everything it runs, and when it passes TaskTimeout is
+    raised inside whatever is still running. Shell commands started
+    with sh are killed when this happens::
+
+        @task(timeout=600)
+        def push(image):
+            sh("docker", "push", image)
+
+    A running task can also be stopped with the cancel method of its
+    result.
+
+    A task can choose how much of its result tree is kept once its
+    subtasks are done, see the executor documentation for the retain
+    modes. This is inherited by everything the task runs::
+
+        @task(retain=RETAIN_ERRORS)
+        def build_everything():
+            ...
+
+    Every invocation of a task is recorded in the METRICS registry
+    under the name of the decorated function.
+
+    Tasks that are pure, or idempotent for the duration of a run, can
+    be memoized. Repeated invocations with the same arguments then
+    return the value of the first successful invocation without
+    running the task again::
+
+        @task(cache=TaskCache(maxsize=1024, ttl=60))
+        def remote_exists(name, version):
+            ...
+
+    Passing cache=True uses a TaskCache with the default settings.
+
+    Concurrent invocations of a task can also be coalesced. With
+    singleflight set, an invocation whose key matches one that is
+    still running attaches to the running one instead of starting a
+    duplicate. The key is computed from the arguments the same way as
+    for caching, singleflight can be True or a key function::
+
+        @task(singleflight=lambda self, url, target: target)
+        def clone(self, url, target):
+            ...
+
     """
 
-    def __init__(self, name = None, context = None):
+    def __init__(self, name = None, context = None, backend = "green", concurrency = None,
+                 timeout = None, cache = None, singleflight = None, retain = None):
         self.name = name
         self.context_template = context
+        self.backend = backend
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.retain = retain
+        self.cache = TaskCache() if cache is True else cache
+        if singleflight is True:
+            singleflight = _default_key
+        self.singleflight = singleflight
+        # events for running invocations keyed by their singleflight
+        # key, they are sent the result once it is done
+        self.inflight = {}
         self.logger = logging.getLogger("tasks")
         self.count = 0
 
@@ -168,6 +262,21 @@ class task(object):
         yield
         exe.verbose = value
 
+    @staticmethod
+    @contextmanager
+    def fields(**fields):
+        """
+        Add fields to the log records of everything run within the
+        block, including tasks launched from it.
+        """
+        exe = executor.current()
+        saved = exe.fields
+        exe.fields = dict(saved, **fields)
+        try:
+            yield
+        finally:
+            exe.fields = saved
+
     @staticmethod
     @contextmanager
     def context(name):
@@ -185,6 +294,21 @@ class task(object):
             return None
         return self.context_template.format(*args, **kwargs)
 
+    def _record(self, result):
+        duration = None if result.started is None else result.finished - result.started
+        METRICS.observe(self.function.__name__, duration, result.value is ERROR)
+
+    def _recorder(self, key, flight):
+        if self.cache is None and flight is None:
+            return self._record
+        def record(result):
+            self._record(result)
+            if flight is not None:
+                self.inflight.pop(flight).send(result)
+            if key is not None and result.value is not ERROR:
+                self.cache.put(key, result.value)
+        return record
+
     def generate_id(self):
         self.count += 1
         return self.count
@@ -218,17 +342,73 @@ class task(object):
     @staticmethod
     def info(*args, **kwargs):
         executor.current().info(*args, **kwargs)
+        _LOGGER.info(*args)
 
     @staticmethod
     def warn(*args, **kwargs):
         executor.current().warn(*args, **kwargs)
+        _LOGGER.warning(*args)
 
     @staticmethod
     def error(*args, **kwargs):
         executor.current().error(*args, **kwargs)
+        _LOGGER.error(*args)
+
+
+def _join(leader):
+    with executor._released_slot():
+        result = leader.wait()
+    return result.get()
+
+def _default_key(*args, **kwargs):
+    return args, tuple(sorted(kwargs.items()))
+
+class TaskCache(object):
 
+    """
+    A least recently used cache of the values of successful task
+    invocations with an optional time to live in seconds. The key
+    function is called with the arguments of each invocation, including
+    self for methods, and must return something hashable.
+
+    Only values are kept, not the results they came from, so a cached
+    entry doesn't hold on to a finished task's subtree or output.
+    """
+
+    def __init__(self, maxsize=1024, ttl=None, key=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.key = key or _default_key
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            expires, value = entry
+            if expires is None or expires > time.time():
+                self.entries[key] = entry
+                self.hits += 1
+                return value
+        self.misses += 1
+        return default
+
+    def put(self, key, value):
+        self.entries.pop(key, None)
+        expires = None if self.ttl is None else time.time() + self.ttl
+        self.entries[key] = (expires, value)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def pop(self, key):
+        self.entries.pop(key, None)
+
+    def clear(self):
+        self.entries.clear()
 
 _UNBOUND = Sentinel("_UNBOUND")
+_MISSING = Sentinel("_MISSING")
 
 class decorator(object):
 
@@ -246,15 +426,68 @@ class decorator(object):
         else:
             return (self.object,) + args
 
+    def _launch(self, async, args, kwargs):
+        munged = self._munge(args)
+        cache = self.task.cache
+        if cache is None:
+            key = None
+        else:
+            key = cache.key(*munged, **kwargs)
+            value = cache.get(key, _MISSING)
+            if value is not _MISSING:
+                return executor(self.task._context(args, kwargs), async=async).finished(value)
+        if self.task.singleflight is None:
+            flight = None
+        else:
+            flight = self.task.singleflight(*munged, **kwargs)
+            leader = self.task.inflight.get(flight)
+            if leader is not None:
+                return self._follow(async, leader, args, kwargs)
+            # registered up front so that a synchronous leader can be
+            # joined while it runs
+            self.task.inflight[flight] = eventlet.event.Event()
+        exe = executor(self.task._context(args, kwargs), async=async, backend=self.task.backend,
+                       concurrency=self.task.concurrency, timeout=self.task.timeout,
+                       retain=self.task.retain, on_done=self.task._recorder(key, flight))
+        try:
+            return exe.run(self.task.function, *munged, **kwargs)
+        except:
+            # we never got as far as starting, so nobody else will
+            # tell the followers
+            if flight is not None and flight in self.task.inflight:
+                self.task.inflight.pop(flight).send_exception(*sys.exc_info())
+            raise
+
+    def _follow(self, async, leader, args, kwargs):
+        if not async:
+            with executor._released_slot():
+                return leader.wait()
+        # an asynchronous follower still shows up in the caller's tree
+        # so that syncing on the caller waits for the shared result
+        exe = executor(self.task._context(args, kwargs), async=True)
+        return exe.run(_join, leader)
+
     def __call__(self, *args, **kwargs):
-        exe = executor(self.task._context(args, kwargs))
-        result = exe.run(self.task.function, *self._munge(args), **kwargs)
-        return result.get()
+        return self._launch(False, args, kwargs).get()
 
     def go(self, *args, **kwargs):
-        exe = executor(self.task._context(args, kwargs), async=True)
-        result = exe.run(self.task.function, *self._munge(args), **kwargs)
-        return result
+        return self._launch(True, args, kwargs)
+
+    def forget(self, *args, **kwargs):
+        """
+        Drop the memoized result for the given arguments, if any.
+        """
+        cache = self.task.cache
+        if cache is not None:
+            cache.pop(cache.key(*self._munge(args), **kwargs))
+
+    def clear(self):
+        """
+        Drop every memoized result, for all arguments.
+        """
+        cache = self.task.cache
+        if cache is not None:
+            cache.clear()
 
     def run(self, *args, **kwargs):
         result = self.go(*args, **kwargs)
@@ -313,35 +546,269 @@ def _taskify(obj):
             return obj(*args, **kwargs)
         return applicator
 
-def project(task, sequence):
-    task = _taskify(task)
-    execs = []
+def _in_order(task, sequence, window):
+    """
+    Launch task for each item of sequence and yield (result, item)
+    pairs in input order. With a window, at most that many invocations
+    are launched ahead of the one being consumed.
+    """
+    pending = deque()
     for obj in sequence:
-        execs.append(task.go(obj))
-    for e in execs:
+        if window is not None and len(pending) >= window:
+            yield pending.popleft()
+        pending.append((task.go(obj), obj))
+    while pending:
+        yield pending.popleft()
+
+def _as_completed(task, sequence, window, inflight):
+    """
+    Launch task for each item of sequence and yield (result, item)
+    pairs as the invocations finish. With a window, at most that many
+    invocations are in flight at once. The invocations that have not
+    been yielded yet are kept in inflight so the caller can cancel
+    them if it stops early.
+    """
+    done = eventlet.queue.LightQueue()
+    items = iter(sequence)
+
+    def notify(result, obj):
+        result.wait()
+        done.put((result, obj))
+
+    def launch():
+        for obj in items:
+            result = task.go(obj)
+            inflight[result] = obj
+            eventlet.spawn_n(notify, result, obj)
+            if window is not None and len(inflight) >= window:
+                break
+
+    launch()
+    while inflight:
+        with executor._released_slot():
+            result, obj = done.get()
+        del inflight[result]
+        # top up the window before handing the result over so that the
+        # next stage overlaps with whatever the consumer does with it
+        launch()
+        yield result, obj
+
+def _abandon(inflight):
+    """
+    Cancel invocations nobody is going to look at, and recover them so
+    that their cancellation doesn't count against the caller.
+    """
+    for result in inflight:
+        result.cancel()
+        result.recover()
+    inflight.clear()
+
+def project(task, sequence, window=None):
+    """
+    Apply task to every item of sequence concurrently, yielding the
+    results in input order and skipping any that are OMIT. A window
+    limits how many invocations are in flight at once.
+    """
+    task = _taskify(task)
+    for e, _ in _in_order(task, sequence, window):
         obj = e.get()
         if obj is not OMIT:
             yield obj
 
-def cull(task, sequence):
+def project_unordered(task, sequence, window=None):
+    """
+    Like project, but yield results as soon as they are ready rather
+    than in input order.
+    """
     task = _taskify(task)
-    execs = []
-    for obj in sequence:
-        execs.append((task.go(obj), obj))
-    for e, obj in execs:
+    for e, _ in _as_completed(task, sequence, window, OrderedDict()):
+        obj = e.get()
+        if obj is not OMIT:
+            yield obj
+
+def cull(task, sequence, window=None):
+    """
+    Yield the items of sequence for which task returns a true value,
+    in input order. A window limits how many invocations are in flight
+    at once.
+    """
+    task = _taskify(task)
+    for e, obj in _in_order(task, sequence, window):
         if e.get():
             yield obj
 
+def first(task, sequence, window=None, default=None):
+    """
+    Return the result of whichever invocation of task over sequence
+    finishes first with a value other than OMIT, or default if there
+    is none. Whatever is still running at that point is cancelled.
+    """
+    task = _taskify(task)
+    inflight = OrderedDict()
+    try:
+        for e, _ in _as_completed(task, sequence, window, inflight):
+            obj = e.get()
+            if obj is not OMIT:
+                return obj
+        return default
+    finally:
+        _abandon(inflight)
+
+def first_success(task, sequence, window=None):
+    """
+    Return True as soon as task returns a true value for some item of
+    sequence. Whatever is still running at that point is cancelled.
+    """
+    task = _taskify(task)
+    inflight = OrderedDict()
+    try:
+        for e, _ in _as_completed(task, sequence, window, inflight):
+            if e.get():
+                return True
+        return False
+    finally:
+        _abandon(inflight)
+
 ## common tasks
 
 from eventlet.green.subprocess import Popen, STDOUT, PIPE
+from eventlet.green import os as green_os
+tempfile = eventlet.import_patched('tempfile')
+
+"""How much command output sh reads at a time."""
+CHUNK_SIZE = 64*1024
+
+# sh capture modes
+CAPTURE_FULL = "full"
+CAPTURE_TAIL = "tail"
+CAPTURE_DISCARD = "discard"
+CAPTURE_SPILL = "spill"
+
+class _LineSplitter(object):
+
+    """
+    Split a stream of chunks into lines without ever copying a partial
+    line more than once.
+    """
+
+    def __init__(self):
+        self.partial = []
+
+    def feed(self, chunk):
+        """
+        Return the lines completed by *chunk*, without line endings.
+        """
+        idx = chunk.rfind("\n")
+        if idx < 0:
+            self.partial.append(chunk)
+            return []
+        self.partial.append(chunk[:idx])
+        text = "".join(self.partial)
+        rest = chunk[idx+1:]
+        self.partial = [rest] if rest else []
+        return text.split("\n")
+
+    def rest(self):
+        return "".join(self.partial)
+
+class _FullCapture(object):
+
+    def __init__(self):
+        self.chunks = []
+
+    def append(self, chunk):
+        self.chunks.append(chunk)
+
+    def getvalue(self):
+        return "".join(self.chunks)
+
+class _TailCapture(object):
+
+    def __init__(self, lines):
+        self.count = lines
+        self.lines = deque(maxlen=lines)
+        self.splitter = _LineSplitter()
+
+    def append(self, chunk):
+        self.lines.extend(self.splitter.feed(chunk)[-self.count:])
+
+    def getvalue(self):
+        lines = [l + "\n" for l in self.lines]
+        rest = self.splitter.rest()
+        if rest:
+            lines.append(rest)
+        return "".join(lines[-self.count:])
+
+class _DiscardCapture(object):
+
+    def append(self, chunk):
+        pass
+
+    def getvalue(self):
+        return ""
+
+class _SpillCapture(object):
+
+    """
+    Keep output in memory until it grows past *threshold* bytes, then
+    move it to an anonymous temporary file.
+    """
+
+    def __init__(self, threshold):
+        self.threshold = threshold
+        self.chunks = []
+        self.size = 0
+        self.file = None
+
+    def append(self, chunk):
+        if self.file is None:
+            self.chunks.append(chunk)
+            self.size += len(chunk)
+            if self.size > self.threshold:
+                self.file = tempfile.TemporaryFile()
+                self.file.writelines(self.chunks)
+                self.chunks = None
+        else:
+            self.file.write(chunk)
+
+    def getvalue(self):
+        if self.file is None:
+            return "".join(self.chunks)
+        else:
+            self.file.seek(0)
+            return self.file.read()
+
+_CAPTURES = {
+    CAPTURE_FULL: lambda kwargs: _FullCapture(),
+    CAPTURE_TAIL: lambda kwargs: _TailCapture(kwargs.pop("tail", 100)),
+    CAPTURE_DISCARD: lambda kwargs: _DiscardCapture(),
+    CAPTURE_SPILL: lambda kwargs: _SpillCapture(kwargs.pop("spill", 16*1024*1024))
+}
 
 class SHResult(object):
 
+    """
+    The outcome of a shell command. The output may be given as a
+    string or as a capture, in which case it is only assembled on
+    first access.
+    """
+
     def __init__(self, command, code, output):
         self.command = command
         self.code = code
-        self.output = output
+        if isinstance(output, basestring):
+            self._capture = None
+            self._output = output
+        else:
+            self._capture = output
+            self._output = None
+
+    @property
+    def output(self):
+        if self._output is None:
+            self._output = self._capture.getvalue()
+            self._capture = None
+        return self._output
 
     def __str__(self):
         if self.code != 0:
@@ -355,9 +822,23 @@ class SHResult(object):
 
 @task("CMD")
 def sh(*args, **kwargs):
+    """
+    Run a command and capture its combined stdout and stderr. How the
+    output is captured is controlled by the capture keyword:
+
+     - CAPTURE_FULL (the default) keeps all of it in memory.
+
+     - CAPTURE_TAIL keeps only the last tail=N lines (default 100).
+
+     - CAPTURE_DISCARD keeps nothing.
+
+     - CAPTURE_SPILL moves the output to a temporary file once it
+       grows past spill=N bytes (default 16MB).
+    """
     output_transform = kwargs.pop("output_transform", lambda l: l)
     expected = kwargs.pop("expected", (0,))
     output_buffer = kwargs.pop("output_buffer", 10)
+    capture = _CAPTURES[kwargs.pop("capture", CAPTURE_FULL)](kwargs)
     cmd = tuple(str(a) for a in args)
 
     kwcopy = kwargs.copy()
@@ -379,21 +860,46 @@ def sh(*args, **kwargs):
 
     try:
         p = Popen(cmd, stderr=STDOUT, stdout=PIPE, **kwargs)
-        output = ""
-        line_buffer = [command]
-        start = time.time()
-        for line in p.stdout:
-            output += line
-            line_buffer.append(output_transform(line[:-1]))
-            elapsed = time.time() - start
-            if (len(line_buffer) > output_buffer) or (elapsed > 1.0):
-                while line_buffer:
-                    task.info(line_buffer.pop(0))
+        try:
+            # nobody can make us verbose once we are running, so if we
+            # aren't there is no need to look at individual lines
+            display = executor.current().verbose
+            splitter = _LineSplitter()
+            line_buffer = deque([command])
             start = time.time()
-        while line_buffer:
-            task.info(line_buffer.pop(0))
-        p.wait()
-        result = SHResult(command, p.returncode, output)
+            fd = p.stdout.fileno()
+            while True:
+                chunk = green_os.read(fd, CHUNK_SIZE)
+                if not chunk:
+                    break
+                capture.append(chunk)
+                if display:
+                    line_buffer.extend(output_transform(l) for l in splitter.feed(chunk))
+                    if (len(line_buffer) > output_buffer) or (time.time() - start > 1.0):
+                        while line_buffer:
+                            task.info(line_buffer.popleft())
+                        start = time.time()
+            if display:
+                rest = splitter.rest()
+                if rest:
+                    line_buffer.append(output_transform(rest))
+                while line_buffer:
+                    task.info(line_buffer.popleft())
+            p.stdout.close()
+            p.wait()
+        except TaskCancelled:
+            # don't leave the command running after we've given up on it
+            if p.poll() is None:
+                p.kill()
+                # an enclosing deadline can go off while we reap
+                while True:
+                    try:
+                        p.wait()
+                        break
+                    except TaskCancelled:
+                        pass
+            raise
+        result = SHResult(command, p.returncode, capture)
     except OSError, e:
         raise TaskError("error executing command '%s': %s" % (command, e))
     if p.returncode in expected:
@@ -413,17 +919,147 @@ def json_patch(response, parser):
             raise
     return patched
 
+import random, urlparse
+
+class _TokenBucket(object):
+
+    """
+    Allow up to *rate* requests a second on average, with bursts of
+    up to *burst* requests.
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = float(burst or max(1, rate))
+        self.tokens = self.burst
+        self.last = time.time()
+
+    def acquire(self):
+        while True:
+            now = time.time()
+            self.tokens = min(self.burst, self.tokens + (now - self.last)*self.rate)
+            self.last = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            eventlet.sleep((1 - self.tokens)/self.rate)
+
+class _HTTP(object):
+
+    """
+    The connection pools, retry policy, and rate limits shared by get,
+    head, and post. Connections are pooled and kept alive per host so
+    that repeated calls to the same registry or API don't each pay for
+    a new TCP and TLS handshake.
+    """
+
+    RETRY_STATUS = (429, 502, 503, 504)
+
+    def __init__(self):
+        self.sessions = {}
+        self.buckets = {}
+        self.retries = 3
+        self.backoff = 0.5
+        # the longest we will wait between attempts, whatever the
+        # server asks for
+        self.max_delay = 30
+        self.pool_size = 32
+
+    def session(self, host):
+        session = self.sessions.get(host)
+        if session is None:
+            session = requests.Session()
+            # requests is imported patched, so get at its adapter class
+            # through the session rather than importing it separately
+            adapter = type(session.get_adapter("https://"))(pool_connections=1,
+                                                            pool_maxsize=self.pool_size)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            self.sessions[host] = session
+        return session
+
+    def delay(self, attempt, response):
+        if response is not None:
+            after = response.headers.get("Retry-After", "")
+            if after.isdigit():
+                return min(int(after), self.max_delay)
+        # full jitter, so that a fan-out of failed requests doesn't
+        # come back in lock step
+        return random.uniform(0, self.backoff*(2**attempt))
+
+    def request(self, method, url, retries, **kwargs):
+        url = str(url)
+        parts = urlparse.urlsplit(url)
+        host = parts.netloc
+        session = self.session((parts.scheme, host))
+        bucket = self.buckets.get(parts.hostname)
+        attempt = 0
+        while True:
+            if bucket is not None:
+                bucket.acquire()
+            try:
+                response = session.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout), e:
+                if attempt >= retries:
+                    raise TaskError(e)
+                response = None
+            except requests.RequestException, e:
+                raise TaskError(e)
+            else:
+                if response.status_code not in self.RETRY_STATUS or attempt >= retries:
+                    response.json = json_patch(response, response.json)
+                    return response
+            eventlet.sleep(self.delay(attempt, response))
+            attempt += 1
+            task.info("retrying %s %s (%s/%s)" % (method, url, attempt, retries))
+
+HTTP = _HTTP()
+
+def http_config(retries=None, backoff=None, rate_limits=None, max_delay=None):
+    """
+    Configure the retry policy and per host rate limits used by get,
+    head, and post. Rate limits are given in requests per second keyed
+    by host name. A Retry-After from the server is obeyed up to
+    max_delay seconds.
+    """
+    if retries is not None:
+        HTTP.retries = retries
+    if backoff is not None:
+        HTTP.backoff = backoff
+    if max_delay is not None:
+        HTTP.max_delay = max_delay
+    for host, rate in (rate_limits or {}).items():
+        HTTP.buckets[host] = _TokenBucket(rate)
+
 @task("GET")
 def get(url, **kwargs):
+    """
+    Fetch *url*. Connection failures and throttling or gateway errors
+    are retried with a jittered exponential backoff.
+    """
     task.info("GET %s" % url)
-    try:
-        response = requests.get(str(url), **kwargs)
-        response.json = json_patch(response, response.json)
-        return response
-    except requests.RequestException, e:
-        raise TaskError(e)
+    return HTTP.request("GET", url, kwargs.pop("retries", HTTP.retries), **kwargs)
 
-import watchdog, watchdog.events
+@task("HEAD")
+def head(url, **kwargs):
+    task.info("HEAD %s" % url)
+    return HTTP.request("HEAD", url, kwargs.pop("retries", HTTP.retries), **kwargs)
+
+@task("POST")
+def post(url, **kwargs):
+    """
+    Post to *url*. A post may not be idempotent, so it is only retried
+    when asked to.
+    """
+    task.info("POST %s" % url)
+    return HTTP.request("POST", url, kwargs.pop("retries", 0), **kwargs)
+
+import watchdog, watchdog.events, watchdog.observers
+from eventlet import tpool
+_Queue = eventlet.patcher.original('Queue')
+
+"""How long a burst of file system events has to go quiet before watch_changes reports it."""
+DEBOUNCE = 0.2
 
 class _Wrapper(watchdog.events.FileSystemEventHandler):
 
@@ -444,3 +1080,54 @@ def watch(paths, action):
     for path in paths:
         obs.schedule(handler, path, recursive=True)
     obs.start()
+
+class _Changes(watchdog.events.FileSystemEventHandler):
+
+    """
+    Collects the paths touched by file system events. Watchdog calls
+    us from its own OS thread, so the paths are handed over through a
+    real queue that green code reads from via tpool.
+    """
+
+    def __init__(self, ignore):
+        self.ignore = ignore
+        self.queue = _Queue.Queue()
+
+    def on_any_event(self, event):
+        for path in event.src_path, getattr(event, "dest_path", None):
+            if path and not self.ignore(path):
+                self.queue.put(path)
+
+    def get(self, timeout):
+        try:
+            return tpool.execute(self.queue.get, True, timeout)
+        except _Queue.Empty:
+            return None
+
+def watch_changes(paths, debounce=DEBOUNCE, ignore=lambda path: False):
+    """
+    Watch *paths* recursively and yield the set of paths touched by
+    each burst of file system events. A burst ends once nothing has
+    changed for *debounce* seconds, so saving several files at once or
+    switching branches shows up as a single set. Paths for which
+    *ignore* returns true neither show up nor extend a burst.
+    """
+    handler = _Changes(ignore)
+    obs = watchdog.observers.Observer()
+    for path in paths:
+        obs.schedule(handler, path, recursive=True)
+    obs.start()
+    try:
+        while True:
+            path = None
+            while path is None:
+                path = handler.get(1.0)
+            burst = set([path])
+            while path is not None:
+                path = handler.get(debounce)
+                if path is not None:
+                    burst.add(path)
+            yield burst
+    finally:
+        obs.stop()
+        tpool.execute(obs.join)
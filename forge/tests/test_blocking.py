@@ -0,0 +1,47 @@
+# Copyright 2017 datawire. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import eventlet, StringIO
+from forge.blocking import Detector
+from forge.tasks import task
+
+_time = eventlet.patcher.original('time')
+
+@task(context="hog")
+def hog():
+    _time.sleep(0.2)
+
+@task()
+def polite():
+    for i in range(10):
+        eventlet.sleep(0.02)
+
+def test_detector():
+    out = StringIO.StringIO()
+    detector = Detector(threshold=0.05, stream=out)
+    detector.start()
+    try:
+        polite.go()
+        hog.go().wait()
+        eventlet.sleep(0.05)
+    finally:
+        detector.stop()
+    offenders = detector.offenders.values()
+    assert [o.context for o in offenders] == ["hog"]
+    hogged, = offenders
+    assert hogged.count == 1
+    assert hogged.worst >= 0.2
+    assert "in hog" in hogged.location
+    assert "hog blocked the hub for" in out.getvalue()
+    assert "in hog (hog)" in detector.report()
@@ -0,0 +1,82 @@
+# Copyright 2017 datawire. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import eventlet, pytest, time
+from forge.dispatcher import Dispatcher, Rejected, REJECT
+from forge.tasks import task
+
+DONE = []
+
+def nap(n):
+    eventlet.sleep(0.1)
+    DONE.append(n)
+
+def test_workers():
+    del DONE[:]
+    d = Dispatcher(workers=5)
+    d.start()
+    start = time.time()
+    for i in range(5):
+        d.schedule(nap, i)
+    with eventlet.Timeout(1):
+        d.join()
+    # five workers take the five jobs in parallel
+    assert time.time() - start < 0.3
+    assert sorted(DONE) == range(5)
+    stats = d.stats()
+    assert stats["dispatched"] == 5
+    assert stats["depth"] == 0
+    assert stats["run_time"]["count"] == 5
+    assert stats["wait_time"]["count"] == 5
+    d.stop()
+
+def test_reject():
+    d = Dispatcher(maxsize=2, policy=REJECT)
+    d.schedule(nap, 0)
+    d.schedule(nap, 1)
+    with pytest.raises(Rejected):
+        d.schedule(nap, 2)
+    assert d.stats()["rejected"] == 1
+    assert d.stats()["depth"] == 2
+
+def test_block():
+    del DONE[:]
+    d = Dispatcher(maxsize=1)
+    d.start()
+    d.schedule(nap, 0)
+    # the worker picks up the first job, making room for this one
+    d.schedule(nap, 1)
+    # and this one waits for the worker to finish the first job and
+    # pick up the second
+    d.schedule(nap, 2)
+    assert DONE == [0]
+    with eventlet.Timeout(1):
+        d.join()
+    assert DONE == [0, 1, 2]
+    d.stop()
+
+@task()
+def failing_child():
+    raise ValueError("oops")
+
+def failing():
+    failing_child.go()
+
+def test_errors():
+    d = Dispatcher()
+    d.schedule(failing)
+    result = d.dispatch()
+    assert isinstance(result.errors[0].exception[1], ValueError)
+    assert "1 errors" in result.report(autocolor=False)
+    assert d.stats()["errors"] == 1
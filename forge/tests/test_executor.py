@@ -13,7 +13,7 @@
 # limitations under the License.
 
 from forge.executor import executor
-import time
+import sys, time
 
 executor.setup()
 
@@ -37,3 +37,139 @@ def test_async_executor():
     exe.wait()
     elapsed = time.time() - start
     assert elapsed < 0.6, elapsed
+
+from forge.executor import STACK_FULL, STACK_LAZY, STACK_OFF
+
+def oops():
+    return 1/0
+
+def launcher():
+    executor("child", async=True).run(oops)
+
+def capture_traceback(mode):
+    exe = executor("root", stack=mode)
+    result = exe.run(launcher)
+    result.wait()
+    [error] = result.leaf_errors
+    return error.get_traceback()
+
+def test_lazy_stack():
+    full, lazy = [capture_traceback(m) for m in (STACK_FULL, STACK_LAZY)]
+    assert "in launcher" in full
+    assert lazy == full
+
+def test_stack_off():
+    tb = capture_traceback(STACK_OFF)
+    assert "in launcher" not in tb
+    assert "in oops" in tb
+
+def chain(depth):
+    if depth:
+        executor("chain", async=True).run(chain, depth - 1)
+    else:
+        oops()
+
+def test_deep_tree():
+    depth = sys.getrecursionlimit() + 100
+    result = executor("root").run(chain, depth)
+    result.wait()
+    assert len(result.errors) == 1
+    assert "%s tasks run, 1 errors" % (depth + 1) in result.report(autocolor=False)
+
+from StringIO import StringIO
+from forge.executor import _Muxer
+import eventlet
+
+def test_muxer_groups_output():
+    stream = StringIO()
+    muxer = _Muxer(stream, interval=0.05)
+
+    def chatter():
+        for i in range(3):
+            muxer.write(u"%s\n" % i)
+            eventlet.sleep()
+
+    def both():
+        executor("a", async=True).run(chatter)
+        executor("b", async=True).run(chatter)
+
+    executor().run(both).get()
+    eventlet.sleep(0.1)
+    assert stream.getvalue() == u"\u2554\u2550a\n0\n1\n2\n\u2554\u2550b\n0\n1\n2\n".encode("UTF-8")
+
+def test_muxer_flush_partial_line():
+    stream = StringIO()
+    muxer = _Muxer(stream, interval=0.05)
+    muxer.write("prompt: ")
+    eventlet.sleep(0.06)
+    assert stream.getvalue() == ""
+    muxer.flush()
+    assert stream.getvalue() == "prompt: "
+
+def test_muxer_flush_at_exit_closed():
+    stream = StringIO()
+    muxer = _Muxer(stream)
+    muxer.write("bye\n")
+    stream.close()
+    muxer._flush_at_exit()
+
+from eventlet import tpool
+
+def test_muxer_threads():
+    stream = StringIO()
+    muxer = _Muxer(stream, interval=0.01)
+    def chatter(n):
+        for i in range(20000):
+            muxer.write("%s %s\n" % (n, i))
+    threads = [eventlet.spawn(tpool.execute, chatter, n) for n in range(3)]
+    while not all(t.dead for t in threads):
+        muxer.flush()
+        eventlet.sleep(0)
+    muxer.flush()
+    lines = stream.getvalue().splitlines()
+    assert sorted(lines) == sorted("%s %s" % (n, i) for n in range(3) for i in range(20000))
+
+from forge.executor import ERROR, RETAIN_ERRORS
+
+def work(i):
+    if i == 3:
+        oops()
+    return "x"*100
+
+def fan_out():
+    exe = executor("worker", async=True)
+    for i in range(10):
+        exe.run(work, i)
+    executor("sync").run(work, 0)
+
+def test_retain_errors():
+    result = executor("root", retain=RETAIN_ERRORS).run(fan_out)
+    result.wait()
+    [error] = result.children
+    assert error.value is ERROR
+    report = result.report(autocolor=False)
+    assert "12 tasks run, 1 errors" in report
+    assert "in fan_out" in report
+
+def test_retain_all():
+    result = executor("root").run(fan_out)
+    result.wait()
+    assert len(result.children) == 11
+
+import greenlet
+
+def test_running(monkeypatch):
+    monkeypatch.setattr(executor, "TRACK", True)
+    seen = []
+    def outer():
+        glet = greenlet.getcurrent()
+        seen.append(executor.running(glet).context)
+        executor("inner").run(lambda: seen.append(executor.running(glet).context))
+        seen.append(executor.running(glet).context)
+        return glet
+    glet = executor("outer").run(outer).get()
+    assert seen == ["outer", "inner", "outer"]
+    assert executor.running(glet) is None
+    # nothing is tracked unless asked for
+    monkeypatch.setattr(executor, "TRACK", False)
+    assert executor("untracked").run(lambda: executor.running(greenlet.getcurrent())).get() is None
@@ -0,0 +1,71 @@
+# Copyright 2017 datawire. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import hashlib, os, time
+from forge import hashing
+from forge.hashing import hash_file, shafiles
+from .common import mktree
+
+TREE = dict(("file%02d" % i, "contents of %s\n" % i * (i + 1)) for i in range(20))
+FILES = sorted(TREE)
+
+def backdate(directory):
+    past = time.time() - 60
+    for name in os.listdir(directory):
+        os.utime(os.path.join(directory, name), (past, past))
+
+def test_hash_file(monkeypatch):
+    directory = mktree({"big": "x"*100000})
+    path = os.path.join(directory, "big")
+    expected = hashlib.sha1("x"*100000).hexdigest()
+    assert hash_file(path) == expected
+    monkeypatch.setattr(hashing, "MMAP_SIZE", 1000)
+    assert hash_file(path) == expected
+
+def test_deterministic(monkeypatch):
+    directory = mktree(TREE)
+    digest = shafiles(directory, FILES)
+    for workers, batch in ((1, 1000), (8, 1), (3, 4)):
+        monkeypatch.setattr(hashing, "WORKERS", workers)
+        monkeypatch.setattr(hashing, "BATCH", batch)
+        assert shafiles(directory, FILES) == digest
+    assert shafiles(directory, list(reversed(FILES))) != digest
+    assert shafiles(directory, FILES + ["missing"]) != digest
+
+def test_stat_cache(monkeypatch):
+    directory = mktree(TREE)
+    backdate(directory)
+    digest = shafiles(directory, FILES)
+    assert os.path.exists(os.path.join(directory, ".forge", "hash-cache.json"))
+
+    # nothing changed, so nothing is read again
+    def unexpected(path):
+        assert False, path
+    monkeypatch.setattr(hashing, "hash_file", unexpected)
+    assert shafiles(directory, FILES) == digest
+
+    # the same size, but a new mtime
+    monkeypatch.undo()
+    with open(os.path.join(directory, "file00"), "w") as fd:
+        fd.write("CONTENTS OF 0\n")
+    assert shafiles(directory, FILES) != digest
+
+def test_racy(monkeypatch):
+    directory = mktree(TREE)
+    shafiles(directory, FILES)
+    # everything was just written, so none of it was trusted
+    hashed = []
+    monkeypatch.setattr(hashing, "hash_file", lambda path: hashed.append(path) or "x")
+    shafiles(directory, FILES)
+    assert len(hashed) == len(FILES)
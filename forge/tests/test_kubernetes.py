@@ -108,3 +108,16 @@ def test_apply_bad():
     except TaskError, e:
         assert "error" in str(e)
         assert "xxx" in str(e)
+
+def test_label():
+    directory = mktree(K8S_TREE)
+    yaml_dir = os.path.join(directory, "k8s")
+    kube = Kubernetes()
+    kube.label(yaml_dir, {"forge.service": "kube-test"})
+    kube.annotate(yaml_dir, {"forge.version": "1234"})
+    from forge import yamlutil
+    docs = yamlutil.load(os.path.join(yaml_dir, "deployment.yaml"))
+    assert len(docs) == 2
+    for d in docs:
+        assert d["metadata"]["labels"]["forge.service"] == "kube-test"
+        assert d["metadata"]["annotations"]["forge.version"] == "1234"
@@ -0,0 +1,89 @@
+# Copyright 2017 datawire. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import eventlet, json, logging, os
+from forge.logs import AsyncHandler
+from forge.tasks import task, TaskFilter
+
+def mklogger(handler):
+    logger = logging.getLogger("test_logs.%s" % id(handler))
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+    logger.addHandler(handler)
+    handler.addFilter(TaskFilter())
+    return logger
+
+def lines(path):
+    with open(path) as fd:
+        return [json.loads(l) for l in fd]
+
+@task(context="logged {0}")
+def logged(logger, service):
+    with task.fields(service=service):
+        inner(logger)
+
+@task()
+def inner(logger):
+    logger.info("hello %s", "world")
+
+def test_task_context(tmpdir):
+    path = str(tmpdir.join("forge.log"))
+    handler = AsyncHandler(path)
+    logged(mklogger(handler), "svc")
+    handler.flush()
+    entry, = lines(path)
+    assert entry["message"] == "hello world"
+    assert entry["level"] == "INFO"
+    assert entry["task"] == "inner"
+    assert entry["context"].startswith("logged ")
+    assert entry["service"] == "svc"
+    assert entry["time"].endswith("Z")
+    assert entry["task_started"] <= entry["time"]
+
+def test_background_writer(tmpdir):
+    path = str(tmpdir.join("forge.log"))
+    handler = AsyncHandler(path, interval=0.01)
+    logger = mklogger(handler)
+    for i in range(100):
+        logger.info("line %d", i)
+    # nothing is written by the code doing the logging
+    assert not os.path.exists(path)
+    with eventlet.Timeout(1):
+        while handler.pending or handler.writer is not None:
+            eventlet.sleep(0.01)
+    assert [e["message"] for e in lines(path)] == ["line %d" % i for i in range(100)]
+    assert all(e["task_id"] == "(none)" for e in lines(path))
+
+def test_rotation(tmpdir):
+    path = str(tmpdir.join("forge.log"))
+    handler = AsyncHandler(path, max_bytes=1000, backups=2)
+    logger = mklogger(handler)
+    for i in range(50):
+        logger.info("x"*100)
+        handler.flush()
+    assert os.path.getsize(path) <= 1000
+    assert os.path.exists(path + ".1")
+    assert os.path.exists(path + ".2")
+    assert not os.path.exists(path + ".3")
+
+def test_dropped(tmpdir):
+    path = str(tmpdir.join("forge.log"))
+    handler = AsyncHandler(path, max_pending=10)
+    logger = mklogger(handler)
+    for i in range(15):
+        logger.info("line %d", i)
+    handler.flush()
+    entries = lines(path)
+    assert len(entries) == 11
+    assert entries[-1]["message"] == "dropped 5 log records"
@@ -0,0 +1,55 @@
+# Copyright 2017 datawire. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+from forge.metrics import Registry
+from forge.tasks import task, METRICS
+
+def test_prometheus():
+    reg = Registry(buckets=(0.1, 1))
+    reg.observe("sh", 0.05, False)
+    reg.observe("sh", 0.5, True)
+    reg.observe("sh", 5, False)
+    text = reg.prometheus()
+    assert 'forge_task_invocations_total{task="sh"} 3' in text
+    assert 'forge_task_errors_total{task="sh"} 1' in text
+    assert 'forge_task_duration_seconds_bucket{task="sh",le="0.1"} 1' in text
+    assert 'forge_task_duration_seconds_bucket{task="sh",le="1"} 2' in text
+    assert 'forge_task_duration_seconds_bucket{task="sh",le="+Inf"} 3' in text
+    assert 'forge_task_duration_seconds_sum{task="sh"} 5.55' in text
+    assert 'forge_task_duration_seconds_count{task="sh"} 3' in text
+
+def test_write_json(tmpdir):
+    reg = Registry(buckets=(0.1, 1))
+    reg.observe("get", 0.5, False)
+    reg.observe("get", None, True)
+    path = str(tmpdir.join("metrics.json"))
+    reg.write(path)
+    with open(path) as fd:
+        data = json.load(fd)
+    assert data == {"get": {"invocations": 2, "errors": 1,
+                            "duration": {"buckets": [["0.1", 0], ["1", 1], ["+Inf", 1]],
+                                         "sum": 0.5, "count": 1}}}
+
+@task()
+def metered(x):
+    return 1/x
+
+def test_task_metrics():
+    metered(1)
+    metered.go(0).wait()
+    metrics = METRICS.tasks["metered"]
+    assert metrics.invocations >= 2
+    assert metrics.errors >= 1
+    assert metrics.duration.count == metrics.invocations
@@ -12,9 +12,10 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import os, pytest
-from forge.core import Forge
-from forge.service import load_service_yamls, Discovery
+import eventlet, os, pytest, time
+from forge import service
+from forge.core import Forge, forget_lookups
+from forge.service import get_version, load_service_yamls, is_service_descriptor, Discovery, MANIFESTS, REBUILD, BUILD
 from forge.tasks import sh, TaskError
 from .common import mktree
 
@@ -223,6 +224,18 @@ def mkgittree(treespec, **substitutions):
     sh("git", "commit", "-m", "initial commit", cwd=directory)
     return directory
 
+def test_forget_lookups():
+    directory = mkgittree(GIT_ROOT + ROOT_SVC)
+    v1 = get_version(directory, "dirty")
+    assert v1.endswith(".git")
+    with open(os.path.join(directory, "root.py"), "a") as fd:
+        fd.write("# changed\n")
+    sh("git", "commit", "-am", "second commit", cwd=directory)
+    assert get_version(directory, "dirty") == v1
+    forget_lookups()
+    v2 = get_version(directory, "dirty")
+    assert v2.endswith(".git") and v2 != v1
+
 def test_discovery_root():
     directory = mkgittree(GIT_ROOT + ROOT_SVC)
     disco = Discovery(Forge())
@@ -282,6 +295,154 @@ def test_discovery_combined():
 
     assert root.version == nested.version
 
+LAYERED_SVC = r"""
+@@.gitignore
+*.log
+build/
+@@
+
+@@service.yaml
+name: layered
+@@
+
+@@app.py
+@@
+
+@@app.log
+@@
+
+@@build/output
+@@
+
+@@sub/.forgeignore
+!keep.log
+@@
+
+@@sub/keep.log
+@@
+
+@@sub/drop.log
+@@
+"""
+
+def test_discovery_layered_ignores():
+    directory = mkgittree(LAYERED_SVC)
+    svc = Discovery(Forge()).search(directory)[0]
+    assert set(svc.files) == set([".gitignore",
+                                  "service.yaml",
+                                  "app.py",
+                                  "sub/.forgeignore",
+                                  "sub/keep.log"])
+
+PRUNED_SVC = r"""
+@@.gitignore
+build/
+!build/keep
+@@
+
+@@service.yaml
+name: pruned
+@@
+
+@@build/keep
+@@
+
+@@build/drop
+@@
+"""
+
+def test_discovery_pruned_reinclude():
+    # as with git, a file can't be re-included once a directory above
+    # it is excluded, the directory is pruned without being listed
+    directory = mktree(PRUNED_SVC)
+    svc = Discovery(Forge()).search(directory)[0]
+    assert set(svc.files) == set([".gitignore", "service.yaml"])
+
+def backdate(directory):
+    past = time.time() - 60
+    for path, dirs, files in os.walk(directory):
+        for name in dirs + files:
+            os.utime(os.path.join(path, name), (past, past))
+    os.utime(directory, (past, past))
+
+def test_discovery_index(monkeypatch):
+    directory = mkgittree(LAYERED_SVC)
+    backdate(directory)
+    files = Discovery(Forge()).search(directory)[0].files
+    assert os.path.exists(os.path.join(directory, ".forge", "discovery-index.json"))
+
+    # nothing changed, so nothing is read or parsed again
+    def unexpected(path):
+        assert False, path
+    monkeypatch.setattr(service, "is_service_descriptor", unexpected)
+    monkeypatch.setattr(service, "_read_ignores", unexpected)
+    assert Discovery(Forge()).search(directory)[0].files == files
+
+    # a new entry changes the mtime of its directory
+    monkeypatch.undo()
+    with open(os.path.join(directory, "sub", "new.py"), "write") as fd:
+        fd.write("")
+    assert set(Discovery(Forge()).search(directory)[0].files) == set(files + ["sub/new.py"])
+
+def test_discovery_parallel(monkeypatch):
+    directory = mkgittree(GIT_ROOT + ROOT_SVC + NESTED_SVC + "@@nested/a/b/c/d.py\n@@\n")
+    def search(walkers, batch):
+        monkeypatch.setattr(service, "WALKERS", walkers)
+        monkeypatch.setattr(service, "BATCH", batch)
+        return [(s.name, s.files, s.dockerfiles) for s in Discovery(Forge()).search(directory)]
+    serial = search(1, 1000)
+    assert [name for name, _, _ in serial] == ["root", "nested"]
+    for walkers, batch in ((8, 1), (3, 2)):
+        assert search(walkers, batch) == serial
+
+@pytest.mark.parametrize("expected, content", [
+    (True, "name: foo"),
+    (True, ""),
+    (True, "{"),
+    (True, "name: {{env.NAME}}\nrequires: {% for r in reqs %}"),
+    (True, "name: foo\nspec: {apiVersion: v1, kind: Service, metadata: {}}"),
+    (True, "- apiVersion\n- kind\n- metadata"),
+    (False, "apiVersion: v1\nkind: Service\nmetadata:\n  name: foo\n"),
+    (False, "metadata: {name: foo}\nkind: Service\n'apiVersion': v1\n---\nname: foo\n"),
+])
+def test_is_service_descriptor(expected, content):
+    assert is_service_descriptor("service.yaml", content) == expected
+
+CLONES = []
+
+class FakeGithub(object):
+
+    def __init__(self, token):
+        pass
+
+    def remote(self, directory):
+        return "https://github.com/forgeorg/root.git"
+
+    def exists(self, url):
+        return True
+
+    def clone(self, url, directory):
+        CLONES.append(url)
+        with open(os.path.join(directory, "service.yaml"), "w") as fd:
+            fd.write("name: dep\n")
+        eventlet.sleep(0.05)
+
+def test_checkout_singleflight(monkeypatch):
+    del CLONES[:]
+    monkeypatch.setattr(service, "Github", FakeGithub)
+    directory = mkgittree(GIT_ROOT + ROOT_SVC)
+    disco = Discovery(Forge())
+    svc = disco.search(directory)[0]
+    target = os.path.join(directory, ".forge", "dep")
+    results = [disco.checkout.go(svc, "dep") for i in range(3)]
+    eventlet.sleep(0.01)
+    # mid clone, nothing half populated shows up at the target
+    assert not os.path.exists(target)
+    assert [r.get() for r in results] == [target]*3
+    assert CLONES == ["https://github.com/forgeorg/dep.git"]
+    assert os.path.exists(os.path.join(target, "service.yaml"))
+    assert [f.name for f in disco.search(target)] == ["dep"]
+
 def test_versioning():
     directory = mkgittree(GIT_ROOT + ROOT_SVC)
 
@@ -300,6 +461,50 @@ def test_versioning():
     assert v3.endswith(".sha")
     assert v2 != v3
 
+REBUILD_SVC = r"""
+@@service.yaml
+name: rebuilt
+containers:
+ - dockerfile: Dockerfile
+   rebuild:
+     root: /code
+     sources:
+      - app.py
+      - lib
+@@
+
+@@Dockerfile
+@@
+
+@@app.py
+@@
+
+@@lib/util.py
+@@
+
+@@README
+@@
+
+@@k8s/deployment.yaml
+@@
+"""
+
+def test_affected():
+    directory = mktree(REBUILD_SVC)
+    svc = Discovery(Forge()).search(directory)[0]
+    assert svc.affected(["k8s/deployment.yaml"]) == (MANIFESTS, ())
+    stage, plan = svc.affected(["app.py", "lib/util.py", "k8s/deployment.yaml"])
+    assert stage == REBUILD
+    assert [changed for c, changed in plan] == [["app.py", "lib/util.py"]]
+    assert svc.affected(["README"]) == (BUILD, ())
+    assert svc.affected(["app.py", "Dockerfile"]) == (BUILD, ())
+    assert svc.affected(["service.yaml"]) == (BUILD, ())
+
+def test_affected_without_rebuild():
+    directory = mkgittree(GIT_ROOT + ROOT_SVC)
+    svc = Discovery(Forge()).search(directory)[0]
+    assert svc.affected(["root.py"]) == (BUILD, ())
+
 def test_nonexistent():
     try:
         Discovery(Forge()).search("thisfileshouldreallynotexist")
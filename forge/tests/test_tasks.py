@@ -24,8 +24,12 @@ from forge.tasks import (
     OMIT,
     PENDING,
     TaskError,
-    ChildError
+    ChildError,
+    CAPTURE_DISCARD,
+    CAPTURE_SPILL,
+    CAPTURE_TAIL
 )
+from forge.backends import BACKENDS
 
 import time
 
@@ -210,6 +214,20 @@ def test_sh_cwd_env():
     assert result.command.startswith("[/tmp] ")
     assert result.command[7:].startswith("FOO=bar ")
 
+SEQ = "seq 1 1000"
+
+def test_sh_capture_tail():
+    result = sh("sh", "-c", SEQ, capture=CAPTURE_TAIL, tail=3)
+    assert result.output == "998\n999\n1000\n"
+
+def test_sh_capture_discard():
+    assert sh("sh", "-c", SEQ, capture=CAPTURE_DISCARD).output == ""
+
+def test_sh_capture_spill():
+    full = sh("sh", "-c", SEQ).output
+    assert sh("sh", "-c", SEQ, capture=CAPTURE_SPILL, spill=100).output == full
+    assert sh("sh", "-c", SEQ, capture=CAPTURE_SPILL).output == full
+
 def test_get():
     response = get("https://httpbin.org/get")
     assert response.json()["url"] == "https://httpbin.org/get"
@@ -372,3 +390,532 @@ def test_task_error():
     exc = anticipated_oops.go()
     exc.wait()
     assert exc.report(autocolor=False) == '1 tasks run, 1 errors\n  anticipated_oops: oopsy'
+
+import eventlet, os
+from eventlet import patcher
+real_threading = patcher.original("threading")
+
+@task(backend="thread")
+def thread_ident():
+    return real_threading.current_thread().ident
+
+def test_thread_backend():
+    assert thread_ident() != real_threading.current_thread().ident
+    results = [thread_ident.go() for i in range(3)]
+    assert all(r.get() != real_threading.current_thread().ident for r in results)
+
+@task(backend="process")
+def process_id(n):
+    return n, os.getpid()
+
+@task(backend="process")
+def process_oops(n):
+    return n/0
+
+def test_process_backend():
+    results = [process_id.go(i) for i in range(4)]
+    values = [r.get() for r in results]
+    assert [n for n, pid in values] == range(4)
+    assert all(pid != os.getpid() for n, pid in values)
+
+def test_process_backend_close():
+    backend = BACKENDS["process"]
+    assert process_id(1)[0] == 1
+    backend.close()
+    assert backend.pool is None
+    # and the workers come back on demand
+    assert process_id(2)[0] == 2
+    backend.close()
+
+@task()
+def process_scatter():
+    process_oops.go(1)
+    process_id.go(2)
+
+def test_process_backend_error():
+    try:
+        process_oops(1)
+        assert False, "should have failed"
+    except ZeroDivisionError, e:
+        pass
+    exe = process_scatter.go()
+    exe.wait()
+    assert exe.value is ERROR
+    assert isinstance(exe.exception[1], ChildError)
+    assert [e.exception[0] for e in exe.errors] == [ZeroDivisionError]
+
+from forge.tasks import executor
+
+running = {"limited": 0, "max": 0}
+
+@task(concurrency="test_limited")
+def limited(span):
+    running["limited"] += 1
+    running["max"] = max(running["max"], running["limited"])
+    eventlet.sleep(span)
+    running["limited"] -= 1
+
+@task(concurrency="test_limited")
+def limited_nested():
+    limited(0.01)
+    limited.go(0.01)
+
+def test_concurrency_limit():
+    executor.limit("test_limited", 2)
+    running["max"] = 0
+    start = time.time()
+    results = [limited.go(0.1) for i in range(6)]
+    # unlimited tasks don't queue behind the limited ones
+    assert noop.go(1).get() == 1
+    assert time.time() - start < 0.1
+    for r in results:
+        r.wait()
+    assert running["max"] == 2
+    assert time.time() - start >= 0.3
+
+def test_concurrency_limit_nested():
+    executor.limit("test_limited", 1)
+    try:
+        exe = limited_nested.go()
+        with eventlet.Timeout(5):
+            exe.wait()
+        assert exe.value is None
+    finally:
+        executor.limit("test_limited", 2)
+
+def test_concurrency_limit_raised():
+    # nothing is running to release a permit, so raising the limit
+    # has to wake the waiters itself
+    executor.limit("test_raised", 0)
+    exe = executor("raised", async=True, concurrency="test_raised")
+    result = exe.run(lambda: 1)
+    eventlet.sleep(0.01)
+    assert result.value is PENDING
+    executor.limit("test_raised", 1)
+    with eventlet.Timeout(1):
+        assert result.get() == 1
+
+from forge.tasks import emod
+
+@task()
+def service_stage(n):
+    return n
+
+# concurrency limited tasks don't run in the pool, so they have to
+# queue for a slot when they fan out
+@task(concurrency="test_fanout")
+def service_fanout(n):
+    staged = list(cull(service_stage, range(n)))
+    return sum(project(service_stage, staged))
+
+@task()
+def service_go(n):
+    return service_fanout.go(3).get()
+
+@task()
+def services(n):
+    for i in range(n):
+        service_go.go(i)
+
+def test_nested_wait_releases_slot():
+    size = emod._POOL.size
+    executor.limit("test_fanout", 8)
+    executor.resize(2)
+    try:
+        exe = services.go(50)
+        with eventlet.Timeout(10):
+            exe.wait()
+        assert exe.value is None
+        assert "351 tasks run, 0 errors" == exe.report(autocolor=False)
+    finally:
+        executor.resize(size)
+
+@task()
+def waits_on_child():
+    return service_stage.go(1).get()
+
+def test_resize_while_lent():
+    size = emod._POOL.size
+    executor.resize(2)
+    try:
+        exe = waits_on_child.go()
+        eventlet.sleep(0)
+        assert executor.LENT == 1
+        executor.resize(4)
+        assert exe.get() == 1
+        emod._POOL.waitall()
+        assert (emod._POOL.size, emod._POOL.free(), executor.LENT) == (4, 4, 0)
+    finally:
+        executor.resize(size)
+
+from forge.tasks import TaskCancelled, TaskTimeout
+
+@task(context="sleeper")
+def sleeper(seconds):
+    eventlet.sleep(seconds)
+    return seconds
+
+@task()
+def spawns_sleeper(seconds):
+    sleeper.go(seconds)
+
+def test_finishing_keeps_slot():
+    size = emod._POOL.size
+    executor.resize(2)
+    try:
+        start = time.time()
+        exe = spawns_sleeper.go(0.1)
+        # let it start its child so that both slots are taken before
+        # anything else queues up for one
+        eventlet.sleep(0.01)
+        queued = [eventlet.spawn(sleeper.go, 0.5) for i in range(2)]
+        exe.wait()
+        # finishing up doesn't put us at the back of the queue
+        assert time.time() - start < 0.3
+        for q in queued:
+            q.wait().wait()
+    finally:
+        executor.resize(size)
+
+@task(timeout=0.1)
+def impatient():
+    sleeper.go(0.05)
+    return sleeper(10)
+
+def test_timeout():
+    start = time.time()
+    result = impatient.go()
+    result.wait()
+    assert time.time() - start < 1
+    assert result.value is ERROR
+    [error] = result.errors
+    assert isinstance(error.exception[1], TaskTimeout)
+    assert "3 tasks run, 0 errors, 1 cancelled" in result.report(autocolor=False)
+    assert "sleeper: timed out after 0.1s" in result.report(autocolor=False)
+
+@task(context="sleeper", concurrency="test_cancel")
+def limited_sleeper(seconds):
+    eventlet.sleep(seconds)
+
+@task()
+def sleepers(n):
+    for i in range(n):
+        limited_sleeper.go(10)
+
+def test_cancel():
+    # one sleeper runs, the rest queue up for their concurrency class
+    executor.limit("test_cancel", 1)
+    result = sleepers.go(5)
+    eventlet.sleep(0.01)
+    result.cancel()
+    with eventlet.Timeout(1):
+        result.wait()
+    assert result.value is ERROR
+    assert len(result.errors) == 5
+    assert all(isinstance(e.exception[1], TaskCancelled) for e in result.errors)
+    assert "6 tasks run, 0 errors, 5 cancelled" in result.report(autocolor=False)
+
+def test_cancel_before_start():
+    result = sleepers.go(5)
+    result.cancel()
+    with eventlet.Timeout(1):
+        result.wait()
+    assert isinstance(result.exception[1], TaskCancelled)
+    assert "1 tasks run, 0 errors, 1 cancelled" in result.report(autocolor=False)
+
+@task(timeout=0.2)
+def hung_command(pidfile):
+    sh("sh", "-c", "echo $$ > %s; exec sleep 10" % pidfile)
+
+def test_sh_killed_on_timeout(tmpdir):
+    pidfile = str(tmpdir.join("pid"))
+    result = hung_command.go(pidfile)
+    with eventlet.Timeout(2):
+        result.wait()
+    assert isinstance(result.exception[1], TaskTimeout)
+    pid = int(open(pidfile).read())
+    try:
+        os.kill(pid, 0)
+        assert False, "command still running"
+    except OSError:
+        pass
+
+from forge.tasks import head, post, http_config, HTTP
+from eventlet.green import BaseHTTPServer
+
+class StubServer(object):
+
+    """
+    A keep-alive HTTP server that counts connections and requests and
+    answers with the queued status codes, 200 once they run out.
+    """
+
+    def __init__(self):
+        self.connections = 0
+        self.requests = []
+        self.statuses = []
+        self.sock = eventlet.listen(("127.0.0.1", 0))
+        self.url = "http://127.0.0.1:%s" % self.sock.getsockname()[1]
+        self.thread = eventlet.spawn(self.serve)
+
+    def serve(self):
+        server = self
+
+        class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # write whole responses, or delayed acks slow everything down
+            wbufsize = -1
+
+            def respond(self):
+                server.requests.append((self.command, self.path))
+                status = server.statuses.pop(0) if server.statuses else 200
+                body = "" if self.command == "HEAD" else '{"path": "%s"}' % self.path
+                self.send_response(status)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            do_GET = do_HEAD = do_POST = respond
+
+            def log_message(self, *args):
+                pass
+
+        while True:
+            conn, addr = self.sock.accept()
+            self.connections += 1
+            eventlet.spawn(Handler, conn, addr, None)
+
+    def close(self):
+        self.thread.kill()
+        self.sock.close()
+
+def test_http_keepalive():
+    server = StubServer()
+    try:
+        for i in range(10):
+            assert get("%s/%s" % (server.url, i)).json() == {"path": "/%s" % i}
+        assert head(server.url + "/head").status_code == 200
+        assert post(server.url + "/post", data="x").status_code == 200
+        assert len(server.requests) == 12
+        assert server.connections == 1
+    finally:
+        server.close()
+
+def test_http_retry():
+    saved = HTTP.backoff
+    http_config(backoff=0.01)
+    server = StubServer()
+    try:
+        server.statuses = [503, 429]
+        assert get(server.url).status_code == 200
+        assert len(server.requests) == 3
+        server.statuses = [503]
+        assert post(server.url).status_code == 503
+        server.statuses = [503, 503]
+        assert get(server.url, retries=1).status_code == 503
+    finally:
+        server.close()
+        http_config(backoff=saved)
+
+class FakeResponse(object):
+
+    def __init__(self, **headers):
+        self.headers = headers
+
+def test_http_retry_after():
+    assert HTTP.delay(0, FakeResponse(**{"Retry-After": "2"})) == 2
+    # a server can't stall us indefinitely
+    assert HTTP.delay(0, FakeResponse(**{"Retry-After": "3600"})) == HTTP.max_delay
+
+def test_http_rate_limit():
+    server = StubServer()
+    try:
+        http_config(rate_limits={"127.0.0.1": 20})
+        start = time.time()
+        for i in range(30):
+            get(server.url)
+        # the first 20 go out as a burst
+        assert time.time() - start > 0.45
+    finally:
+        HTTP.buckets.clear()
+        server.close()
+
+from forge.tasks import TaskCache
+
+CALLS = []
+
+@task(cache=TaskCache(maxsize=2))
+def memoized(x):
+    CALLS.append(x)
+    return 1/x
+
+def test_cache():
+    del CALLS[:]
+    cache = memoized.task.cache
+    cache.clear()
+    assert memoized(1) == 1
+    assert memoized.go(1).get() == 1
+    assert CALLS == [1]
+    assert (cache.hits, cache.misses) == (1, 1)
+    # only the value is kept, each hit gets a result of its own
+    assert [v for e, v in cache.entries.values()] == [1]
+    first, second = memoized.go(1), memoized.go(1)
+    assert first is not second
+    assert (first.get(), second.get()) == (1, 1)
+    assert (cache.hits, cache.misses) == (3, 1)
+    # errors are not cached
+    for i in range(2):
+        try:
+            memoized(0)
+            assert False, "expected error"
+        except ZeroDivisionError:
+            pass
+    assert CALLS == [1, 0, 0]
+    # least recently used entries are evicted
+    memoized(2)
+    memoized(3)
+    memoized(1)
+    assert CALLS == [1, 0, 0, 2, 3, 1]
+    memoized.forget(3)
+    memoized(3)
+    assert CALLS == [1, 0, 0, 2, 3, 1, 3]
+    memoized.clear()
+    memoized(1)
+    memoized(2)
+    assert CALLS == [1, 0, 0, 2, 3, 1, 3, 1, 2]
+
+@task(cache=TaskCache(ttl=0.05))
+def expiring(x):
+    CALLS.append(x)
+    return x
+
+def test_cache_ttl():
+    del CALLS[:]
+    expiring(1)
+    expiring(1)
+    eventlet.sleep(0.06)
+    expiring(1)
+    assert CALLS == [1, 1]
+
+@task(singleflight=True)
+def flight(x):
+    CALLS.append(x)
+    eventlet.sleep(0.05)
+    return 1/x
+
+@task()
+def flight_sync(x):
+    return flight(x)
+
+def test_singleflight():
+    del CALLS[:]
+    results = [flight.go(1) for i in range(3)] + [flight_sync.go(1) for i in range(3)]
+    assert [r.get() for r in results] == [1]*6
+    assert CALLS == [1]
+    assert flight.task.inflight == {}
+    # the next invocation runs again
+    assert flight(1) == 1
+    assert CALLS == [1, 1]
+
+@task()
+def flights():
+    for i in range(3):
+        flight.go(0)
+
+def test_singleflight_error():
+    del CALLS[:]
+    result = flights.go()
+    result.wait()
+    assert CALLS == [0]
+    assert all(isinstance(e.exception[1], ZeroDivisionError) for e in result.errors)
+    # the followers fail with the leader, but it is one failure
+    report = result.report(autocolor=False)
+    assert "1 errors" in report
+    assert report.count("ZeroDivisionError") == 1
+
+from forge.tasks import first, first_success, project_unordered
+
+RUNNING = []
+
+@task()
+def napper(seconds):
+    RUNNING.append(seconds)
+    try:
+        eventlet.sleep(seconds)
+    finally:
+        RUNNING.remove(seconds)
+    return seconds
+
+def test_project_window():
+    peak = []
+    @task()
+    def watched(seconds):
+        peak.append(len(RUNNING) + 1)
+        return napper(seconds)
+    assert [0.01]*10 == list(project(watched, [0.01]*10, window=3))
+    assert max(peak) == 3
+
+def test_cull_window():
+    assert [0, 2, 4, 6, 8] == list(cull(is_even, range(10), window=2))
+
+def test_project_unordered():
+    assert [0.01, 0.05, 0.1] == list(project_unordered(napper, [0.1, 0.05, 0.01]))
+    assert [0, 2, 4, 6, 8] == sorted(project_unordered(even_project, range(10), window=2))
+
+@task()
+def fastest(seconds):
+    return first(napper, seconds)
+
+def test_first():
+    result = fastest.go([1, 0.01, 1])
+    with eventlet.Timeout(0.5):
+        assert result.get() == 0.01
+    # the slow nappers are cancelled, but that doesn't count as an error
+    assert RUNNING == []
+    assert "0 errors" in result.report(autocolor=False)
+    assert "cancelled" not in result.report(autocolor=False)
+    assert first(even_project, [1, 3], default=-1) == -1
+
+@task()
+def any_even(numbers):
+    return first_success(is_even, numbers)
+
+def test_first_success():
+    assert any_even.go([1, 3, 4, 5]).get() is True
+    assert any_even.go([1, 3, 5]).get() is False
+
+from forge.tasks import watch_changes
+
+def test_watch_changes(tmpdir):
+    changes = watch_changes([str(tmpdir)], debounce=0.2, ignore=lambda p: p.endswith(".ignored"))
+    def touch():
+        for name in "a", "b", "c.ignored":
+            tmpdir.join(name).write("changed")
+            eventlet.sleep(0.05)
+    # the observer only starts once we ask for the first burst
+    eventlet.spawn_after(0.5, touch)
+    try:
+        with eventlet.Timeout(5):
+            burst = next(changes)
+    finally:
+        changes.close()
+    assert set([str(tmpdir.join("a")), str(tmpdir.join("b"))]) <= burst
+    assert not [p for p in burst if p.endswith(".ignored")]
+
+from forge.tasks import RETAIN_ALL, RETAIN_ERRORS
+
+@task(retain=RETAIN_ERRORS)
+def forgetful():
+    for i in range(3):
+        noop.go(i)
+
+def test_task_retain():
+    result = forgetful.go()
+    result.wait()
+    assert result.children == []
+    assert "4 tasks run, 0 errors" in result.report(autocolor=False)
+    # only the task's own tree is affected
+    assert executor.RETAIN == RETAIN_ALL
+    result = even_project.go(2)
+    result.wait()
+    assert result.executor.retain == RETAIN_ALL
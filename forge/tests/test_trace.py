@@ -0,0 +1,70 @@
+# Copyright 2017 datawire. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json, time
+from StringIO import StringIO
+from forge.tasks import task
+from forge import trace
+
+@task(context="leaf")
+def leaf(n):
+    time.sleep(0.01)
+    if n == 2:
+        raise ValueError(n)
+    return n
+
+@task(context="fanout")
+def fanout(n):
+    leaf(0)
+    for i in range(1, n):
+        leaf.go(i)
+
+def test_trace():
+    result = fanout.go(3)
+    result.wait()
+
+    out = StringIO()
+    trace.dump(result, out)
+    events = json.loads(out.getvalue())["traceEvents"]
+
+    spans = [e for e in events if e["ph"] == "X"]
+    assert [s["name"] for s in spans] == ["fanout", "leaf", "leaf", "leaf"]
+    root = spans[0]
+    assert root["args"]["parent"] is None
+    assert root["args"]["status"] == "error"
+    for s in spans[1:]:
+        assert s["args"]["parent"] == root["args"]["id"]
+        assert s["args"]["context"] == "leaf"
+        assert s["ts"] >= root["ts"]
+        assert s["ts"] + s["dur"] <= root["ts"] + root["dur"]
+        assert s["dur"] >= 10000
+    assert [s["args"]["status"] for s in spans[1:]] == ["ok", "ok", "error"]
+
+    # the sync child shares a track with its parent, the async
+    # children each get their own
+    assert spans[1]["tid"] == root["tid"]
+    assert len(set(s["tid"] for s in spans)) == 3
+    assert len([e for e in events if e["ph"] == "M"]) == 3
+
+def test_write(tmpdir):
+    result = fanout.go(2)
+    result.wait()
+    path = str(tmpdir.join("trace.json"))
+    trace.write(result, path)
+    with open(path) as fd:
+        events = json.load(fd)["traceEvents"]
+    out = StringIO()
+    trace.dump(result, out)
+    assert events == json.loads(out.getvalue())["traceEvents"]
+    assert set(e["name"] for e in events if e["ph"] == "X") == set(["fanout", "leaf"])
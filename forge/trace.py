@@ -0,0 +1,87 @@
+# Copyright 2017 datawire. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Export an executor result tree as a timeline in the Chrome
+trace-event format. The output can be loaded into chrome://tracing
+or https://ui.perfetto.dev.
+"""
+
+import json
+from .tasks import ERROR, PENDING
+
+def status(result):
+    if result.value is PENDING:
+        return "pending"
+    elif result.value is ERROR:
+        return "error"
+    else:
+        return "ok"
+
+def events(root):
+    """
+    Yield one complete ("X") trace event per result in the tree rooted
+    at *root*. Synchronous invocations share a track with their
+    caller, every asynchronous invocation gets its own track so that
+    overlapping greenthreads render side by side.
+    """
+    base = root.started or 0
+    ids = {}
+    tracks = 0
+
+    todo = [(root, None)]
+    while todo:
+        result, tid = todo.pop()
+        if tid is None or result.executor.async:
+            tracks += 1
+            tid = tracks
+            yield {"name": "thread_name", "ph": "M", "pid": 1, "tid": tid,
+                   "args": {"name": "%s" % (result.executor.context or result.name)}}
+        ids[result] = len(ids) + 1
+        if result.started is None:
+            continue
+        end = result.finished
+        if end is None:
+            end = result.started
+        yield {"name": result.name or "<unknown>",
+               "cat": "task",
+               "ph": "X",
+               "pid": 1,
+               "tid": tid,
+               "ts": int((result.started - base)*1e6),
+               "dur": int((end - result.started)*1e6),
+               "args": {"id": ids[result],
+                        "parent": ids.get(result.parent),
+                        "context": result.executor.context,
+                        "status": status(result)}}
+        todo.extend((ch, tid) for ch in reversed(result.children))
+
+def dump(root, stream):
+    """
+    Stream the trace for the tree rooted at *root* to *stream* one
+    event at a time.
+    """
+    stream.write('{"traceEvents": [\n')
+    first = True
+    for evt in events(root):
+        if first:
+            first = False
+        else:
+            stream.write(",\n")
+        stream.write(json.dumps(evt))
+    stream.write('\n], "displayTimeUnit": "ms"}\n')
+
+def write(root, path):
+    with open(path, "w") as fd:
+        dump(root, fd)
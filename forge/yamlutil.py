@@ -13,7 +13,8 @@
 # limitations under the License.
 
 from yaml import ScalarNode, SequenceNode, MappingNode, CollectionNode, Node, compose, compose_all, serialize, \
-    serialize_all
+    serialize_all, parse, CollectionStartEvent, CollectionEndEvent, DocumentStartEvent, MappingStartEvent, \
+    MappingEndEvent, ScalarEvent, StreamStartEvent
 from forge.match import choice, match, many
 from StringIO import StringIO
 
@@ -200,3 +201,29 @@ def _load(stream):
     for nd in compose_all(stream):
         results.append(view(nd, LEAF_AS_PYTHON))
     return results
+
+def top_level_keys(content):
+    """
+    Yield the scalar keys at the top level of the first document in
+    content if it is a mapping. This works off the parser's events, so
+    nothing is composed, and it stops as soon as the caller does.
+    """
+    depth = 0
+    is_key = False
+    for event in parse(content):
+        if isinstance(event, (StreamStartEvent, DocumentStartEvent)):
+            continue
+        if depth == 0:
+            if not isinstance(event, MappingStartEvent):
+                return
+        elif depth == 1:
+            if isinstance(event, MappingEndEvent):
+                return
+            # each event at this depth starts a key or a value
+            is_key = not is_key
+            if is_key and isinstance(event, ScalarEvent):
+                yield event.value
+        if isinstance(event, CollectionStartEvent):
+            depth += 1
+        elif isinstance(event, CollectionEndEvent):
+            depth -= 1